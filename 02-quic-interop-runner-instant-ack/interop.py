@@ -87,6 +87,8 @@ class InteropRunner:
         file_size="10",
         cert_chain="1",
         enable_qlog=True,
+        full_dissection=False,
+        cert_pool_size=1,
     ):
         logger = logging.getLogger()
         logger.setLevel(logging.DEBUG)
@@ -118,6 +120,8 @@ class InteropRunner:
         self._file_size = file_size
         self._cert_chain = cert_chain
         self._enable_qlog = enable_qlog
+        self._full_dissection = full_dissection
+        self._cert_pool = testcases.CertChainPool(int(cert_pool_size))
 
         if len(custom_name) > 0:
             custom_name = f"_{custom_name}"
@@ -154,12 +158,11 @@ class InteropRunner:
 
         client_log_dir = tempfile.TemporaryDirectory(dir="/tmp", prefix="logs_client_")
         www_dir = tempfile.TemporaryDirectory(dir="/tmp", prefix="compliance_www_")
-        certs_dir = tempfile.TemporaryDirectory(dir="/tmp", prefix="compliance_certs_")
+        certs_dir = self._cert_pool.get(1)
         downloads_dir = tempfile.TemporaryDirectory(
             dir="/tmp", prefix="compliance_downloads_"
         )
 
-        testcases.generate_cert_chain(certs_dir.name)
         qlogdir = "/logs/qlog/"
         if not self._enable_qlog:
             logging.debug("Disabled qlog.")
@@ -167,7 +170,7 @@ class InteropRunner:
         # check that the client is capable of returning UNSUPPORTED
         logging.debug("Checking compliance of %s client", name)
         cmd = (
-            "CERTS=" + certs_dir.name + " "
+            "CERTS=" + certs_dir + " "
             "TESTCASE_CLIENT=" + random_string(6) + " "
             "SERVER_LOGS=/dev/null "
             "CLIENT_LOGS=" + client_log_dir.name + " "
@@ -201,7 +204,7 @@ class InteropRunner:
             qlogdir = ""
 
         cmd = (
-            "CERTS=" + certs_dir.name + " "
+            "CERTS=" + certs_dir + " "
             "TESTCASE_SERVER=" + random_string(6) + " "
             "SERVER_LOGS=" + server_log_dir.name + " "
             "CLIENT_LOGS=/dev/null "
@@ -406,6 +409,8 @@ class InteropRunner:
             file_size=self._file_size,
             repetitions=self._repetitions,
             cert_chain=self._cert_chain,
+            full_dissection=self._full_dissection,
+            cert_pool=self._cert_pool,
         )
         print(
             "Server: "
@@ -598,6 +603,7 @@ class InteropRunner:
                     res = self._run_measurement(server, client, measurement)
                     self.measurement_results[server][client][measurement] = res
 
+        self._cert_pool.cleanup()
         self._print_results()
         self._export_results()
         return nr_failed
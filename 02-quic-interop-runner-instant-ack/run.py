@@ -108,6 +108,12 @@ def main():
         parser.add_argument(
             "-w", "--disable-qlog", help="disable qlog logging", default=False, const=True, action="store_const",
         )
+        parser.add_argument(
+            "-x", "--full-dissection", help="Dissect and decrypt the traces in measurements to check handshakes, versions and files. Otherwise goodput is read from the pcap headers.", default=False, const=True, action="store_const",
+        )
+        parser.add_argument(
+            "-y", "--cert-pool-size", help="Number of cert chains generated per chain length and shared by all test cases of a run", default = "1"
+        )
 
         return parser.parse_args()
 
@@ -188,6 +194,8 @@ def main():
         file_size=get_args().file_size,
         cert_chain=get_args().cert_chain_length,
         enable_qlog=not get_args().disable_qlog,
+        full_dissection=get_args().full_dissection,
+        cert_pool_size=get_args().cert_pool_size,
     ).run()
 
 
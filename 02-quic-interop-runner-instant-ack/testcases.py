@@ -18,7 +18,7 @@ from trace import (
     get_direction,
     get_packet_type,
 )
-from typing import List
+from typing import List, Optional
 
 from Crypto.Cipher import AES
 
@@ -67,6 +67,37 @@ def generate_cert_chain(directory: str, length: int = 1):
         sys.exit(1)
 
 
+class CertChainPool:
+    """Certificate chains generated once per run, by chain length.
+
+    The first size requests of a length generate a chain each, later requests get
+    them round robin. Endpoints mount the certs read-only, so chains are shared.
+    """
+
+    def __init__(self, size: int = 1):
+        self._size = max(1, size)
+        self._dirs = {}
+        self._requests = {}
+
+    def get(self, length: int) -> str:
+        """Get the directory of a certificate chain."""
+        dirs = self._dirs.setdefault(length, [])
+        i = self._requests.get(length, 0)
+        self._requests[length] = i + 1
+        if len(dirs) < self._size:
+            d = tempfile.TemporaryDirectory(dir="/tmp", prefix=f"certs_{length}_")
+            generate_cert_chain(d.name, length)
+            dirs.append(d)
+        return dirs[i % self._size].name + "/"
+
+    def cleanup(self):
+        for dirs in self._dirs.values():
+            for d in dirs:
+                d.cleanup()
+        self._dirs = {}
+        self._requests = {}
+
+
 class TestCase(abc.ABC):
     _files = []
     _www_dir = None
@@ -85,6 +116,10 @@ class TestCase(abc.ABC):
     _file_size = ""
     _repetitions = "100"
     _cert_chain = "1"
+    _cert_pool = None
+    _full_dissection = False
+    # Checks reading pyshark packets and columns of a trace dissect it with pyshark only
+    _trace_backend = "tshark"
 
     def __init__(
             self,
@@ -99,6 +134,8 @@ class TestCase(abc.ABC):
             file_size: str,
             repetitions: str,
             cert_chain: str,
+            full_dissection: bool = False,
+            cert_pool: Optional[CertChainPool] = None,
     ):
         self._server_keylog_file = server_keylog_file
         self._client_keylog_file = client_keylog_file
@@ -111,6 +148,8 @@ class TestCase(abc.ABC):
         self._queue = queue
         self._file_size = file_size
         self._cert_chain = cert_chain
+        self._full_dissection = full_dissection
+        self._cert_pool = cert_pool
 
     def repetitions(self) -> int:
         return int(self._repetitions)
@@ -164,10 +203,15 @@ class TestCase(abc.ABC):
             )
         return self._download_dir.name + "/"
 
+    def cert_chain_length(self) -> int:
+        return int(self._cert_chain)
+
     def certs_dir(self):
+        if self._cert_pool is not None:
+            return self._cert_pool.get(self.cert_chain_length())
         if not self._cert_dir:
             self._cert_dir = tempfile.TemporaryDirectory(dir="/tmp", prefix="certs_")
-            generate_cert_chain(self._cert_dir.name, int(self._cert_chain))
+            generate_cert_chain(self._cert_dir.name, self.cert_chain_length())
         return self._cert_dir.name + "/"
 
     def _is_valid_keylog(self, filename) -> bool:
@@ -193,14 +237,18 @@ class TestCase(abc.ABC):
     def _client_trace(self):
         if self._cached_client_trace is None:
             self._cached_client_trace = TraceAnalyzer(
-                self._sim_log_dir.name + "/trace_node_left.pcap", self._keylog_file()
+                self._sim_log_dir.name + "/trace_node_left.pcap",
+                self._keylog_file(),
+                backend=self._trace_backend,
             )
         return self._cached_client_trace
 
     def _server_trace(self):
         if self._cached_server_trace is None:
             self._cached_server_trace = TraceAnalyzer(
-                self._sim_log_dir.name + "/trace_node_right.pcap", self._keylog_file()
+                self._sim_log_dir.name + "/trace_node_right.pcap",
+                self._keylog_file(),
+                backend=self._trace_backend,
             )
         return self._cached_server_trace
 
@@ -215,7 +263,8 @@ class TestCase(abc.ABC):
         return filename
 
     def _retry_sent(self) -> bool:
-        return len(self._client_trace().get_retry()) > 0
+        retries = self._client_trace().get_column("packet", PacketType.RETRY)
+        return len(retries) > 0
 
     def _check_version_and_files(self) -> bool:
         versions = [hex(int(v, 0)) for v in self._get_versions()]
@@ -278,12 +327,15 @@ class TestCase(abc.ABC):
         tr = self._server_trace()
         # Determine the number of handshakes by looking at Initial packets.
         # This is easier, since the SCID of Initial packets doesn't changes.
-        return len(set([p.scid for p in tr.get_initial(Direction.FROM_SERVER)]))
+        scids = tr.get_column("scid", PacketType.INITIAL, Direction.FROM_SERVER)
+        return len(set(scids))
 
     def _get_versions(self) -> set:
         """Get the QUIC versions"""
         tr = self._server_trace()
-        return set([p.version for p in tr.get_initial(Direction.FROM_SERVER)])
+        return set(
+            tr.get_column("version", PacketType.INITIAL, Direction.FROM_SERVER)
+        )
 
     def _payload_size(self, packets: List) -> int:
         """Get the sum of the payload sizes of all packets"""
@@ -845,6 +897,8 @@ class TestCaseHTTP3(TestCase):
 
 
 class TestCaseAmplificationLimit(TestCase):
+    _trace_backend = "pyshark"
+
     @staticmethod
     def name():
         return "amplificationlimit"
@@ -861,11 +915,8 @@ class TestCaseAmplificationLimit(TestCase):
     def desc():
         return "The server obeys the 3x amplification limit."
 
-    def certs_dir(self):
-        if not self._cert_dir:
-            self._cert_dir = tempfile.TemporaryDirectory(dir="/tmp", prefix="certs_")
-            generate_cert_chain(self._cert_dir.name, 9)
-        return self._cert_dir.name + "/"
+    def cert_chain_length(self) -> int:
+        return 9
 
     @staticmethod
     def scenario() -> str:
@@ -889,12 +940,12 @@ class TestCaseAmplificationLimit(TestCase):
             return TestResult.FAILED
         # Check the highest offset of CRYPTO frames sent by the server.
         # This way we can make sure that it actually used the provided cert chain.
-        max_handshake_offset = 0
-        for p in self._server_trace().get_handshake(Direction.FROM_SERVER):
-            if hasattr(p, "crypto_offset"):
-                max_handshake_offset = max(
-                    max_handshake_offset, int(p.crypto_offset) + int(p.crypto_length)
-                )
+        crypto_ends = self._server_trace().get_column(
+            "crypto_end", PacketType.HANDSHAKE, Direction.FROM_SERVER
+        )
+        max_handshake_offset = max(
+            [e for e in crypto_ends if e is not None], default=0
+        )
         if max_handshake_offset < 7500:
             logging.info(
                 "Server sent too little Handshake CRYPTO data (%d bytes). Not using the provided cert chain?",
@@ -1036,20 +1087,14 @@ class TestCaseKeyUpdate(TestCaseHandshake):
         client = {0: 0, 1: 0}
         server = {0: 0, 1: 0}
         try:
-
-            def _get_key_phase(pkt) -> int:
-                kp: str = pkt.key_phase.raw_value
-                # when key_phase bit is set in a QUIC packet, certain versions
-                # of wireshark (4.0.11, for example) have been seen to return the string value
-                # "1" and certain other versions of wireshark return the string value "True".
-                # here we deal with such values and return the integer value 1 for either of those.
-                return 1 if kp in ["1", "True"] else 0
-
-            for p in self._client_trace().get_1rtt(Direction.FROM_CLIENT):
-                key_phase = _get_key_phase(p)
+            # key phases that couldn't be read are None
+            for key_phase in self._client_trace().get_column(
+                "key_phase", PacketType.ONERTT, Direction.FROM_CLIENT
+            ):
                 client[key_phase] += 1
-            for p in self._server_trace().get_1rtt(Direction.FROM_SERVER):
-                key_phase = _get_key_phase(p)
+            for key_phase in self._server_trace().get_column(
+                "key_phase", PacketType.ONERTT, Direction.FROM_SERVER
+            ):
                 server[key_phase] += 1
         except Exception:
             logging.info(
@@ -1212,11 +1257,12 @@ class TestCaseECN(TestCaseHandshake):
     def abbreviation():
         return "E"
 
-    def _count_ecn(self, tr):
+    def _count_ecn(self, tr, direction: Direction):
         ecn = [0] * (max(ECN) + 1)
-        for p in tr:
-            e = int(getattr(p["ip"], "dsfield.ecn"))
-            ecn[e] += 1
+        for e in tr.get_column("ecn", direction=direction, per_datagram=True):
+            # e.g. IPv6 packets, which have no IPv4 ECN field
+            if e is not None:
+                ecn[e] += 1
         for e in ECN:
             logging.debug("%s %d", e, ecn[e])
         return ecn
@@ -1231,12 +1277,9 @@ class TestCaseECN(TestCaseHandshake):
                 and ((e[ECN.ECT0] == 0) != (e[ECN.ECT1] == 0))
         )
 
-    def _check_ack_ecn(self, tr) -> bool:
+    def _check_ack_ecn(self, tr, direction: Direction) -> bool:
         # NOTE: We only check whether the trace contains any ACK-ECN information, not whether it is valid
-        for p in tr:
-            if hasattr(p["quic"], "ack.ect0_count"):
-                return True
-        return False
+        return any(tr.get_column("ack_ecn", direction=direction, per_datagram=True))
 
     def check(self) -> TestResult:
         if not self._keylog_file():
@@ -1247,21 +1290,17 @@ class TestCaseECN(TestCaseHandshake):
         if result != TestResult.SUCCEEDED:
             return result
 
-        tr_client = self._client_trace()._get_packets(
-            self._client_trace()._get_direction_filter(Direction.FROM_CLIENT) + " quic"
-        )
-        ecn = self._count_ecn(tr_client)
+        tr_client = self._client_trace()
+        ecn = self._count_ecn(tr_client, Direction.FROM_CLIENT)
         ecn_client_any_marked = self._check_ecn_any(ecn)
         ecn_client_all_ok = self._check_ecn_marks(ecn)
-        ack_ecn_client_ok = self._check_ack_ecn(tr_client)
+        ack_ecn_client_ok = self._check_ack_ecn(tr_client, Direction.FROM_CLIENT)
 
-        tr_server = self._server_trace()._get_packets(
-            self._server_trace()._get_direction_filter(Direction.FROM_SERVER) + " quic"
-        )
-        ecn = self._count_ecn(tr_server)
+        tr_server = self._server_trace()
+        ecn = self._count_ecn(tr_server, Direction.FROM_SERVER)
         ecn_server_any_marked = self._check_ecn_any(ecn)
         ecn_server_all_ok = self._check_ecn_marks(ecn)
-        ack_ecn_server_ok = self._check_ack_ecn(tr_server)
+        ack_ecn_server_ok = self._check_ack_ecn(tr_server, Direction.FROM_SERVER)
 
         if ecn_client_any_marked is False:
             logging.info("Client did not mark any packets ECT(0) or ECT(1)")
@@ -1294,6 +1333,8 @@ class TestCaseECN(TestCaseHandshake):
 
 
 class TestCasePortRebinding(TestCaseTransfer):
+    _trace_backend = "pyshark"
+
     @staticmethod
     def name():
         return "rebind-port"
@@ -1330,9 +1371,7 @@ class TestCasePortRebinding(TestCaseTransfer):
         if result != TestResult.SUCCEEDED:
             return result
 
-        tr_server = self._server_trace()._get_packets(
-            self._server_trace()._get_direction_filter(Direction.FROM_SERVER) + " quic"
-        )
+        tr_server = self._server_trace().get_raw_packets(Direction.FROM_SERVER)
 
         ports = list(set(getattr(p["udp"], "dstport") for p in tr_server))
 
@@ -1366,9 +1405,7 @@ class TestCasePortRebinding(TestCaseTransfer):
                     logging.info(p["quic"])
                     return TestResult.FAILED
 
-        tr_client = self._client_trace()._get_packets(
-            self._client_trace()._get_direction_filter(Direction.FROM_CLIENT) + " quic"
-        )
+        tr_client = self._client_trace().get_raw_packets(Direction.FROM_CLIENT)
 
         challenges = list(
             set(
@@ -1427,9 +1464,7 @@ class TestCaseAddressRebinding(TestCasePortRebinding):
             logging.info("Can't check test result. SSLKEYLOG required.")
             return TestResult.UNSUPPORTED
 
-        tr_server = self._server_trace()._get_packets(
-            self._server_trace()._get_direction_filter(Direction.FROM_SERVER) + " quic"
-        )
+        tr_server = self._server_trace().get_raw_packets(Direction.FROM_SERVER)
 
         ips = set()
         for p in tr_server:
@@ -1453,6 +1488,8 @@ class TestCaseAddressRebinding(TestCasePortRebinding):
 
 
 class TestCaseIPv6(TestCaseTransfer):
+    _trace_backend = "pyshark"
+
     @staticmethod
     def name():
         return "ipv6"
@@ -1485,10 +1522,11 @@ class TestCaseIPv6(TestCaseTransfer):
         if result != TestResult.SUCCEEDED:
             return result
 
-        tr_server = self._server_trace()._get_packets(
-            self._server_trace()._get_direction_filter(Direction.FROM_SERVER)
-            + " quic && ip"
-        )
+        tr_server = [
+            p
+            for p in self._server_trace().get_raw_packets(Direction.FROM_SERVER)
+            if hasattr(p, "ip")
+        ]
 
         if tr_server:
             logging.info("Packet trace contains %s IPv4 packets.", len(tr_server))
@@ -1532,9 +1570,7 @@ class TestCaseConnectionMigration(TestCaseAddressRebinding):
         if result != TestResult.SUCCEEDED:
             return result
 
-        tr_client = self._client_trace()._get_packets(
-            self._client_trace()._get_direction_filter(Direction.FROM_CLIENT) + " quic"
-        )
+        tr_client = self._client_trace().get_raw_packets(Direction.FROM_CLIENT)
 
         last = None
         dcid = None
@@ -1686,20 +1722,38 @@ class MeasurementGoodput(Measurement):
         return self._files
 
     def check(self) -> TestResult:
-        return TestResult.SUCCEEDED
-        num_handshakes = self._count_handshakes()
-        if num_handshakes != 1:
-            logging.info("Expected exactly 1 handshake. Got: %d", num_handshakes)
-            return TestResult.FAILED
-        if not self._check_version_and_files():
-            return TestResult.FAILED
+        if self._full_dissection:
+            num_handshakes = self._count_handshakes()
+            if num_handshakes != 1:
+                logging.info("Expected exactly 1 handshake. Got: %d", num_handshakes)
+                return TestResult.FAILED
+            if not self._check_version_and_files():
+                return TestResult.FAILED
 
-        packets, first, last = self._client_trace().get_1rtt_sniff_times(
-            Direction.FROM_SERVER
-        )
+            packets, first, last = self._client_trace().get_1rtt_sniff_times(
+                Direction.FROM_SERVER
+            )
+        else:
+            # Only the timing of the transfer is required, read the pcap headers
+            try:
+                first, last = self._client_trace().scan_1rtt_sniff_times(
+                    Direction.FROM_SERVER
+                )
+            except FileNotFoundError:
+                logging.debug("No trace of the client, goodput not measured.")
+                return TestResult.SUCCEEDED
+            except ValueError as e:
+                logging.debug("Can't read pcap headers (%s), dissecting the trace.", e)
+                packets, first, last = self._client_trace().get_1rtt_sniff_times(
+                    Direction.FROM_SERVER
+                )
 
-        if last - first == 0:
-            return TestResult.FAILED
+        if first == last:
+            if self._full_dissection:
+                return TestResult.FAILED
+            # Measuring goodput alone never fails the measurement, the result stays 0
+            logging.info("Less than two 1-RTT datagrams from the server, no goodput.")
+            return TestResult.SUCCEEDED
         time = (last - first) / timedelta(milliseconds=1)
         goodput = (8 * self.FILESIZE) / time
         logging.debug(
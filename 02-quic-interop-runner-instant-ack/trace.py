@@ -1,9 +1,24 @@
 import datetime
+import json
 import logging
+import os
+import socket
+import struct
+import subprocess
+import tempfile
+from array import array
 from enum import Enum
-from typing import List, Optional, Tuple
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Tuple
 
 import pyshark
+from pyshark.tshark.tshark import get_process_path
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
 
 IP4_CLIENT = "193.167.0.100"
 IP4_SERVER = "193.167.100.100"
@@ -13,6 +28,67 @@ IP6_SERVER = "fd00:cafe:cafe:100::100"
 
 QUIC_V2 = hex(0x6B3343CF)
 
+# Fields of a QUIC packet read by the tshark backend, by their pyshark attribute name
+TSHARK_QUIC_FIELDS = {
+    "header_form": "quic.header_form",
+    "long_packet_type": "quic.long.packet_type",
+    "long_packet_type_v2": "quic.long.packet_type_v2",
+    "version": "quic.version",
+    "scid": "quic.scid",
+    "key_phase": "quic.key_phase",
+    "crypto_offset": "quic.crypto.offset",
+    "crypto_length": "quic.crypto.length",
+    "ack_ect0_count": "quic.ack.ect0_count",
+    "decryption_failed": "quic.decryption_failed",
+}
+
+# Further fields kept in the table of the tshark backend, for analyses of the trace.
+# Fields of the datagram are repeated for coalesced packets, repeated fields of a QUIC
+# packet are joined by ",".
+TSHARK_DATAGRAM_FIELDS = [
+    "frame.time_epoch",
+    "ip.src",
+    "ip.dst",
+    "ip.ttl",
+    "udp.length",
+    "udp.srcport",
+    "udp.dstport",
+]
+TSHARK_PACKET_FIELDS = [
+    "quic.long.packet_type",
+    "quic.dcid",
+    "quic.frame_type",
+    "quic.ack.ack_delay",
+    "quic.ack.ack_range",
+    "quic.ack.first_ack_range",
+    "tls.quic.parameter.ack_delay_exponent",
+    "tls.handshake.type",
+    "tls.handshake.extensions_server_name",
+]
+
+# Columns of pyshark objects, only the pyshark backend provides them
+PYSHARK_COLUMNS = ["layer"]
+
+# Columns of the packet table stored in arrays, by type code
+# quic marks rows of packets matching (quic && !icmp), only the tshark table has rows of
+# other packets
+ARRAY_COLUMNS = {
+    "packet": "l",
+    "quic": "b",
+    "direction": "b",
+    "packet_type": "b",
+    "size": "l",
+    "key_phase": "b",
+    "crypto_end": "l",
+    "sniff_time": "d",
+    "ecn": "b",
+    "ack_ecn": "b",
+}
+TABLE_COLUMNS = list(ARRAY_COLUMNS) + ["version", "scid"]
+
+# Format of the sidecar file, files of other versions are read from the trace again
+SIDECAR_VERSION = 3
+
 
 class Direction(Enum):
     ALL = 0
@@ -47,6 +123,14 @@ WIRESHARK_PACKET_TYPES_V2 = {
 }
 
 
+def get_src_direction(src: Optional[str]) -> Direction:
+    if src in [IP4_CLIENT, IP6_CLIENT]:
+        return Direction.FROM_CLIENT
+    if src in [IP4_SERVER, IP6_SERVER]:
+        return Direction.FROM_SERVER
+    return Direction.INVALID
+
+
 def get_direction(p) -> Direction:
     if (hasattr(p, "ip") and p.ip.src == IP4_CLIENT) or (
         hasattr(p, "ipv6") and p.ipv6.src == IP6_CLIENT
@@ -62,27 +146,362 @@ def get_direction(p) -> Direction:
 
 
 def get_packet_type(p) -> PacketType:
-    if p.quic.header_form == "0":
+    return get_layer_packet_type(p.quic)
+
+
+def get_layer_packet_type(layer) -> PacketType:
+    """Get the type of a QUIC packet, coalesced packets have one QUIC layer each."""
+    if getattr(layer, "header_form", None) == "0":
         return PacketType.ONERTT
-    if p.quic.version == "0x00000000":
+    version = getattr(layer, "version", None)
+    if version == "0x00000000":
         return PacketType.VERSIONNEGOTIATION
-    if p.quic.version == QUIC_V2:
+    if version == QUIC_V2 or hasattr(layer, "long_packet_type_v2"):
         for t, num in WIRESHARK_PACKET_TYPES_V2.items():
-            if p.quic.long_packet_type_v2 == num:
+            if getattr(layer, "long_packet_type_v2", None) == num:
                 return t
         return PacketType.INVALID
     for t, num in WIRESHARK_PACKET_TYPES.items():
-        if p.quic.long_packet_type == num:
+        if getattr(layer, "long_packet_type", None) == num:
             return t
     return PacketType.INVALID
 
 
+def get_key_phase(layer) -> Optional[int]:
+    """Get the key phase bit of a 1-RTT packet, None if it can't be read."""
+    if not hasattr(layer, "key_phase"):
+        return None
+    kp: str = getattr(layer.key_phase, "raw_value", layer.key_phase)
+    # when key_phase bit is set in a QUIC packet, certain versions
+    # of wireshark (4.0.11, for example) have been seen to return the string value
+    # "1" and certain other versions of wireshark return the string value "True".
+    # here we deal with such values and return the integer value 1 for either of those.
+    return 1 if kp in ["1", "True"] else 0
+
+
+def get_crypto_end(layer) -> Optional[int]:
+    """Get the end offset of the (first) CRYPTO frame of a packet."""
+    if not hasattr(layer, "crypto_offset"):
+        return None
+    return int(layer.crypto_offset) + int(layer.crypto_length)
+
+
+def get_ek_name(field: str) -> str:
+    """Get the name of a field in tshark's EK output, e.g. ip.src is ip_ip_src."""
+    return (field.split(".")[0] + "." + field).replace(".", "_")
+
+
+def find_fields(tree, fields: Dict[str, str], found: Optional[Dict] = None) -> Dict:
+    """Find the first value of fields in a layer of tshark's EK output.
+
+    Returns the values by the keys of fields, like the attributes of a pyshark layer.
+    """
+    if found is None:
+        found = {}
+    names = {get_ek_name(field): name for name, field in fields.items()}
+    for key, value in tree.items():
+        if key in names and names[key] not in found:
+            # repeated fields are lists
+            found[names[key]] = str(first(value))
+        elif isinstance(value, dict):
+            find_fields(value, fields, found)
+        elif isinstance(value, list):
+            for v in value:
+                if isinstance(v, dict):
+                    find_fields(v, fields, found)
+    return found
+
+
+def find_all_fields(
+    tree, fields: List[str], found: Optional[Dict] = None
+) -> Dict[str, List[str]]:
+    """Find all values of fields in a layer of tshark's EK output, in order."""
+    if found is None:
+        found = {field: [] for field in fields}
+    names = {get_ek_name(field): field for field in fields}
+    for key, value in tree.items():
+        if key in names:
+            values = value if isinstance(value, list) else [value]
+            found[names[key]] += [str(v) for v in values]
+        elif isinstance(value, dict):
+            find_all_fields(value, fields, found)
+        elif isinstance(value, list):
+            for v in value:
+                if isinstance(v, dict):
+                    find_all_fields(v, fields, found)
+    return found
+
+
+def first(value):
+    """Get the first of repeated layers or fields in tshark's EK output."""
+    return value[0] if isinstance(value, list) else value
+
+
+# pcap magic numbers, byte order and time stamp resolution
+PCAP_MAGIC = {
+    b"\xd4\xc3\xb2\xa1": ("<", 1e-6),
+    b"\xa1\xb2\xc3\xd4": (">", 1e-6),
+    b"\x4d\x3c\xb2\xa1": ("<", 1e-9),
+    b"\xa1\xb2\x3c\x4d": (">", 1e-9),
+}
+QUIC_PORT = 443
+
+
+def get_ip_offset(linktype: int, data: bytes) -> Optional[int]:
+    """Get the offset of the IP header in a captured frame, None if it isn't IP."""
+    if linktype == 1:  # Ethernet
+        offset, ethertype = 14, struct.unpack_from("!H", data, 12)[0]
+        if ethertype == 0x8100:  # VLAN
+            offset, ethertype = 18, struct.unpack_from("!H", data, 16)[0]
+    elif linktype in [12, 14, 101, 228, 229]:  # raw IP
+        return 0
+    elif linktype == 9:  # PPP, e.g. ns-3 point-to-point devices
+        protocol = struct.unpack_from("!H", data, 2)[0]
+        return 4 if protocol in [0x0021, 0x0057] else None
+    elif linktype == 113:  # Linux cooked capture
+        offset, ethertype = 16, struct.unpack_from("!H", data, 14)[0]
+    elif linktype == 276:  # Linux cooked capture v2
+        offset, ethertype = 20, struct.unpack_from("!H", data, 0)[0]
+    else:
+        raise ValueError("Unsupported link type %d" % linktype)
+    return offset if ethertype in [0x0800, 0x86DD] else None
+
+
+def read_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    """Read a QUIC variable-length integer, returns its value and the next offset."""
+    length = 1 << (data[offset] >> 6)
+    value = data[offset] & 0x3F
+    for b in data[offset + 1 : offset + length]:
+        value = (value << 8) | b
+    return value, offset + length
+
+
+def get_datagram_packet_types(payload: bytes) -> List[PacketType]:
+    """Get the types of the (coalesced) QUIC packets of a UDP payload.
+
+    Only the unprotected parts of the headers are read, no keys are required.
+    """
+    types = []
+    offset = 0
+    try:
+        while offset < len(payload):
+            first = payload[offset]
+            if first & 0x80 == 0:
+                # Only the header form bit is reliable, the fixed bit may be greased
+                # (RFC 9287). After a coalesced long header packet, bytes with the
+                # fixed bit cleared are padding.
+                if offset > 0 and first & 0x40 == 0:
+                    break
+                # a short header packet extends to the end of the datagram
+                types.append(PacketType.ONERTT)
+                break
+            version = hex(struct.unpack_from("!I", payload, offset + 1)[0])
+            if version == "0x0":
+                types.append(PacketType.VERSIONNEGOTIATION)
+                break
+            long_types = (
+                WIRESHARK_PACKET_TYPES_V2
+                if version == QUIC_V2
+                else WIRESHARK_PACKET_TYPES
+            )
+            packet_type = PacketType.INVALID
+            for t, num in long_types.items():
+                if (first & 0x30) >> 4 == int(num):
+                    packet_type = t
+            types.append(packet_type)
+            if packet_type == PacketType.RETRY:
+                break
+            pos = offset + 5
+            pos += 1 + payload[pos]  # DCID
+            pos += 1 + payload[pos]  # SCID
+            if packet_type == PacketType.INITIAL:
+                token_length, pos = read_varint(payload, pos)
+                pos += token_length
+            length, pos = read_varint(payload, pos)
+            offset = pos + length
+    except (IndexError, struct.error):
+        pass
+    return types
+
+
+def scan_1rtt_sniff_times(
+    filename: str, direction: Direction = Direction.ALL
+) -> Tuple[datetime.datetime, datetime.datetime]:
+    """Get the first and last sniff times of 1-RTT packets without dissecting the trace.
+
+    Walks the pcap records and IP/UDP headers and reads the header form of the
+    (coalesced) QUIC packets.
+    """
+    sources = {
+        Direction.FROM_CLIENT: [
+            socket.inet_pton(socket.AF_INET, IP4_CLIENT),
+            socket.inet_pton(socket.AF_INET6, IP6_CLIENT),
+        ],
+        Direction.FROM_SERVER: [
+            socket.inet_pton(socket.AF_INET, IP4_SERVER),
+            socket.inet_pton(socket.AF_INET6, IP6_SERVER),
+        ],
+    }
+    with open(filename, "rb") as f:
+        data = f.read()
+    if data[:4] not in PCAP_MAGIC:
+        raise ValueError("Not a pcap file: %s" % filename)
+    order, resolution = PCAP_MAGIC[data[:4]]
+    linktype = struct.unpack_from(order + "I", data, 20)[0] & 0x0FFFFFFF
+
+    first, last = 0, 0
+    offset = 24
+    # If the pcap has been cut short in the middle of the packet, stop there.
+    while offset + 16 <= len(data):
+        ts_sec, ts_frac, incl_len, _ = struct.unpack_from(order + "IIII", data, offset)
+        frame = data[offset + 16 : offset + 16 + incl_len]
+        offset += 16 + incl_len
+        try:
+            ip = get_ip_offset(linktype, frame)
+            if ip is None:
+                continue
+            if frame[ip] >> 4 == 4:
+                # skip non-UDP packets and non-first fragments
+                if (
+                    frame[ip + 9] != 17
+                    or struct.unpack_from("!H", frame, ip + 6)[0] & 0x1FFF
+                ):
+                    continue
+                src = frame[ip + 12 : ip + 16]
+                udp = ip + (frame[ip] & 0x0F) * 4
+            elif frame[ip] >> 4 == 6:
+                if frame[ip + 6] != 17:
+                    continue
+                src = frame[ip + 8 : ip + 24]
+                udp = ip + 40
+            else:
+                continue
+            sport, dport, length = struct.unpack_from("!HHH", frame, udp)
+        except (IndexError, struct.error):
+            continue
+        if QUIC_PORT not in [sport, dport]:
+            continue
+        if direction != Direction.ALL and src not in sources[direction]:
+            continue
+        if PacketType.ONERTT not in get_datagram_packet_types(
+            frame[udp + 8 : udp + length]
+        ):
+            continue
+        sniff_time = datetime.datetime.fromtimestamp(ts_sec + ts_frac * resolution)
+        if first == 0:
+            first = sniff_time
+        last = sniff_time
+    return first, last
+
+
+def get_sidecar_file(filename: str) -> str:
+    """Get the file of the packet table of a trace, e.g. trace_node_left.packets.parquet."""
+    return os.path.splitext(filename)[0] + ".packets.parquet"
+
+
+def get_file_stat(filename: Optional[str]) -> Optional[List[int]]:
+    """Get size and modification time of a file, copied logs keep both."""
+    try:
+        stat = os.stat(filename)
+    except (OSError, TypeError):
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class PacketTable:
+    """Columns of a packet table, one row per QUIC packet.
+
+    Numbers, enums, times (as POSIX timestamps) and flags are stored in arrays, None
+    as -1. The other columns are lists.
+    """
+
+    def __init__(self, columns: List[str]):
+        self.columns = {
+            column: array(ARRAY_COLUMNS[column]) if column in ARRAY_COLUMNS else []
+            for column in columns
+        }
+
+    def __len__(self) -> int:
+        return len(self.columns["packet"])
+
+    def __contains__(self, column: str) -> bool:
+        return column in self.columns
+
+    def append(self, **row):
+        for column, values in self.columns.items():
+            values.append(self._encode(column, row.get(column)))
+
+    def _encode(self, column: str, value):
+        if column not in ARRAY_COLUMNS:
+            return value
+        if value is None:
+            return -1
+        if isinstance(value, Enum):
+            return value.value
+        if isinstance(value, datetime.datetime):
+            return value.timestamp()
+        if ARRAY_COLUMNS[column] == "d":
+            return float(value)
+        return int(value)
+
+    def _decode(self, column: str, value):
+        if column not in ARRAY_COLUMNS:
+            return value
+        if column == "direction":
+            return Direction(value)
+        if column == "packet_type":
+            return PacketType(value)
+        if column == "sniff_time":
+            return datetime.datetime.fromtimestamp(value)
+        if column == "ack_ecn":
+            return bool(value)
+        return None if value == -1 else value
+
+    def get_rows(
+        self,
+        packet_type: Optional[PacketType] = None,
+        direction: Direction = Direction.ALL,
+    ) -> List[int]:
+        """Get the rows of QUIC packets of a type and direction."""
+        quic = self.columns["quic"]
+        types = self.columns["packet_type"]
+        directions = self.columns["direction"]
+        t = None if packet_type is None else packet_type.value
+        d = direction.value
+        return [
+            i
+            for i in range(len(self))
+            if quic[i]
+            and (t is None or types[i] == t)
+            and (direction == Direction.ALL or directions[i] == d)
+        ]
+
+    def get(self, column: str, rows: List[int]) -> List:
+        values = self.columns[column]
+        return [self._decode(column, values[i]) for i in rows]
+
+
 class TraceAnalyzer:
+    """Dissects a trace once, all getters are filtered views of its packet table.
+
+    The tshark backend reads only the fields of the table in one tshark run, streaming
+    its EK output. Getters returning pyshark layers or packets dissect the trace with
+    pyshark, all columns are then read from the pyshark table. The table of the tshark
+    backend is stored next to the trace (if pyarrow is installed), later analyzers of
+    the same trace and keys read it instead.
+    """
+
     _filename = ""
 
-    def __init__(self, filename: str, keylog_file: Optional[str] = None):
+    def __init__(
+        self, filename: str, keylog_file: Optional[str] = None, backend="tshark"
+    ):
         self._filename = filename
         self._keylog_file = keylog_file
+        self._backend = backend
+        self._packets = None
+        self._table = None
+        self._pyshark_table = None
 
     def _get_direction_filter(self, d: Direction) -> str:
         f = "(quic && !icmp) && "
@@ -126,11 +545,257 @@ class TraceAnalyzer:
                     break
         return packets
 
+    def _get_table(self, column: Optional[str] = None) -> PacketTable:
+        """Get the packet table, one row per QUIC packet (layer).
+
+        Coalesced packets have one row per QUIC packet. Once the trace was dissected
+        with pyshark, its table is used for all columns.
+        """
+        if (
+            self._backend == "pyshark"
+            or column in PYSHARK_COLUMNS
+            or self._pyshark_table is not None
+        ):
+            return self._get_pyshark_table()
+        if self._table is None:
+            self._table = self._read_sidecar()
+        if self._table is None:
+            try:
+                self._table = self._get_tshark_table()
+            except (OSError, ValueError, KeyError) as e:
+                logging.info("Couldn't read trace with tshark, using pyshark: %s", e)
+                self._table = self._get_pyshark_table()
+            else:
+                self._write_sidecar(self._table)
+        return self._table
+
+    def _get_sidecar_key(self) -> str:
+        """Identify the trace and keylog the table is read from."""
+        return json.dumps(
+            {
+                "version": SIDECAR_VERSION,
+                "trace": get_file_stat(self._filename),
+                "keylog": get_file_stat(self._keylog_file),
+            }
+        )
+
+    def _read_sidecar(self) -> Optional[PacketTable]:
+        """Read the table from the sidecar file, None if it is missing or outdated."""
+        if pa is None:
+            return None
+        try:
+            sidecar = pq.read_table(get_sidecar_file(self._filename))
+        except (OSError, pa.ArrowException):
+            return None
+        metadata = sidecar.schema.metadata or {}
+        if metadata.get(b"trace") != self._get_sidecar_key().encode():
+            return None
+        table = PacketTable(sidecar.column_names)
+        for column in sidecar.column_names:
+            values = sidecar.column(column).to_pylist()
+            if column in ARRAY_COLUMNS:
+                values = array(ARRAY_COLUMNS[column], values)
+            table.columns[column] = values
+        return table
+
+    def _write_sidecar(self, table: PacketTable):
+        """Write the table as compressed parquet file next to the trace."""
+        if pa is None:
+            return
+        sidecar = get_sidecar_file(self._filename)
+        columns = {
+            column: pa.array(values.tolist() if isinstance(values, array) else values)
+            for column, values in table.columns.items()
+        }
+        try:
+            pq.write_table(
+                pa.table(columns, metadata={"trace": self._get_sidecar_key()}),
+                sidecar + ".tmp",
+                compression="zstd",
+            )
+            os.replace(sidecar + ".tmp", sidecar)
+        except (OSError, pa.ArrowException) as e:
+            logging.debug("Couldn't write %s: %s", sidecar, e)
+
+    def _get_tshark_table(self) -> PacketTable:
+        """Run tshark once, keeping only the fields of the table.
+
+        The EK output has one line per packet and is parsed while tshark runs. Like
+        tools/tshark-extract-quic-fields.sh of the analysis, tshark dissects in two
+        passes and keeps all packets, rows not matching (quic && !icmp) are hidden.
+        """
+        cmd = [
+            get_process_path(),
+            "-n",
+            "-r",
+            self._filename,
+            "-2",
+            "-T",
+            "ek",
+            "-J",
+            "frame ip ipv6 udp icmp quic",
+            "--disable-protocol",
+            "http3",
+            "-d",
+            "udp.port==443,quic",
+        ]
+        if self._keylog_file is not None:
+            cmd += ["-o", "tls.keylog_file:" + self._keylog_file]
+
+        table = PacketTable(
+            TABLE_COLUMNS + TSHARK_DATAGRAM_FIELDS + TSHARK_PACKET_FIELDS
+        )
+        decryption_failed = False
+        with tempfile.TemporaryFile() as stderr, subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=stderr
+        ) as p:
+            i = 0
+            for line in p.stdout:
+                layers = json.loads(line).get("layers")
+                # index lines precede the packets
+                if layers is None:
+                    continue
+                decryption_failed |= self._add_ek_packet(table, i, layers)
+                i += 1
+            p.wait()
+            # If the pcap has been cut short in the middle of the packet, tshark
+            # fails after writing the complete packets.
+            if p.returncode != 0:
+                stderr.seek(0)
+                logging.debug(stderr.read().decode("utf-8"))
+        if self._keylog_file is not None and decryption_failed:
+            logging.info("At least one QUIC packet could not be decrypted")
+        return table
+
+    def _add_ek_packet(self, table: PacketTable, i: int, layers: Dict) -> bool:
+        """Add the QUIC packets of a captured packet, True if decryption failed."""
+        decryption_failed = False
+        ip = first(layers.get("ip", {}))
+        ipv6 = first(layers.get("ipv6", {}))
+        udp = first(layers.get("udp", {}))
+        datagram = find_fields(
+            {"frame": first(layers["frame"]), "ip": ip, "ipv6": ipv6, "udp": udp},
+            {
+                "ipv6.src": "ipv6.src",
+                # the ECN bits are a field of the DS field tree
+                "ecn": "ip.dsfield.ecn",
+                **{field: field for field in TSHARK_DATAGRAM_FIELDS},
+            },
+        )
+        direction = get_src_direction(datagram.get("ip.src"))
+        if direction == Direction.INVALID:
+            direction = get_src_direction(datagram.get("ipv6.src"))
+        # subtract the UDP header length
+        size = int(datagram["udp.length"]) - 8 if "udp.length" in datagram else None
+        sniff_time = float(datagram["frame.time_epoch"])
+        # as the display filter of the pyshark backend
+        is_quic = "quic" in layers and "icmp" not in layers
+        # other packets have a row without QUIC fields
+        quic = layers.get("quic", {})
+        for fields in quic if isinstance(quic, list) else [quic]:
+            layer = SimpleNamespace(**find_fields(fields, TSHARK_QUIC_FIELDS))
+            packet_type = get_layer_packet_type(layer)
+            decryption_failed |= is_quic and hasattr(layer, "decryption_failed")
+            values = find_all_fields(fields, TSHARK_PACKET_FIELDS)
+            table.append(
+                packet=i,
+                quic=is_quic,
+                direction=direction,
+                packet_type=packet_type,
+                version=getattr(layer, "version", None),
+                scid=getattr(layer, "scid", None),
+                size=size,
+                key_phase=(
+                    get_key_phase(layer) if packet_type == PacketType.ONERTT else None
+                ),
+                crypto_end=get_crypto_end(layer),
+                sniff_time=sniff_time,
+                ecn=datagram.get("ecn"),
+                ack_ecn=hasattr(layer, "ack_ect0_count"),
+                **{field: datagram.get(field) for field in TSHARK_DATAGRAM_FIELDS},
+                **{
+                    field: ",".join(values[field]) or None
+                    for field in TSHARK_PACKET_FIELDS
+                },
+            )
+        return decryption_failed
+
+    def _get_pyshark_table(self) -> PacketTable:
+        """Get the packet table of pyshark packets.
+
+        The column "packet" is the index of the datagram in self._packets, "layer" is the
+        pyshark layer of the QUIC packet.
+        """
+        if self._pyshark_table is not None:
+            return self._pyshark_table
+        self._packets = self._get_packets(
+            self._get_direction_filter(Direction.ALL) + "quic"
+        )
+        table = PacketTable(TABLE_COLUMNS + PYSHARK_COLUMNS)
+        for i, p in enumerate(self._packets):
+            direction = get_direction(p)
+            # subtract the UDP header length
+            size = int(p.udp.length) - 8 if hasattr(p, "udp") else None
+            ecn = None
+            if hasattr(p, "ip") and hasattr(p.ip, "dsfield.ecn"):
+                ecn = getattr(p.ip, "dsfield.ecn")
+            for layer in p.layers:
+                if layer.layer_name != "quic":
+                    continue
+                packet_type = get_layer_packet_type(layer)
+                table.append(
+                    packet=i,
+                    quic=True,
+                    layer=layer,
+                    direction=direction,
+                    packet_type=packet_type,
+                    version=getattr(layer, "version", None),
+                    scid=getattr(layer, "scid", None),
+                    size=size,
+                    key_phase=(
+                        get_key_phase(layer)
+                        if packet_type == PacketType.ONERTT
+                        else None
+                    ),
+                    crypto_end=get_crypto_end(layer),
+                    sniff_time=p.sniff_time,
+                    ecn=ecn,
+                    ack_ecn=hasattr(layer, "ack.ect0_count"),
+                )
+        self._pyshark_table = table
+        return table
+
+    def _get_datagrams(
+        self,
+        packet_type: Optional[PacketType] = None,
+        direction: Direction = Direction.ALL,
+    ) -> List:
+        """Get the captured packets containing QUIC packets of a type, each once."""
+        table = self._get_pyshark_table()
+        rows = table.get_rows(packet_type, direction)
+        packets = table.get("packet", rows)
+        return [self._packets[i] for i in sorted(set(packets))]
+
+    def get_column(
+        self,
+        column: str,
+        packet_type: Optional[PacketType] = None,
+        direction: Direction = Direction.ALL,
+        per_datagram: bool = False,
+    ) -> List:
+        """Get a column of the packet table, for QUIC packets of a type and direction.
+
+        per_datagram only returns the first QUIC packet of coalesced packets.
+        """
+        table = self._get_table(column)
+        rows = table.get_rows(packet_type, direction)
+        if per_datagram:
+            packets = table.columns["packet"]
+            rows = [i for i in rows if i == 0 or packets[i - 1] != packets[i]]
+        return table.get(column, rows)
+
     def get_raw_packets(self, direction: Direction = Direction.ALL) -> List:
-        packets = []
-        for packet in self._get_packets(self._get_direction_filter(direction) + "quic"):
-            packets.append(packet)
-        return packets
+        return self._get_datagrams(direction=direction)
 
     def get_1rtt(self, direction: Direction = Direction.ALL) -> List:
         """Get all QUIC packets, one or both directions."""
@@ -141,51 +806,28 @@ class TraceAnalyzer:
         self, direction: Direction = Direction.ALL
     ) -> Tuple[List, datetime.datetime, datetime.datetime]:
         """Get all QUIC packets, one or both directions, and first and last sniff times."""
-        packets = []
-        first, last = 0, 0
-        for packet in self._get_packets(
-            self._get_direction_filter(direction) + "quic.header_form==0"
-        ):
-            for layer in packet.layers:
-                if (
-                    layer.layer_name == "quic"
-                    and not hasattr(layer, "long_packet_type")
-                    and not hasattr(layer, "long_packet_type_v2")
-                ):
-                    if first == 0:
-                        first = packet.sniff_time
-                    last = packet.sniff_time
-                    packets.append(layer)
-        return packets, first, last
+        packets = self.get_column("layer", PacketType.ONERTT, direction)
+        sniff_times = self.get_column("sniff_time", PacketType.ONERTT, direction)
+        if len(sniff_times) == 0:
+            return packets, 0, 0
+        return packets, sniff_times[0], sniff_times[-1]
+
+    def scan_1rtt_sniff_times(
+        self, direction: Direction = Direction.ALL
+    ) -> Tuple[datetime.datetime, datetime.datetime]:
+        """Get the first and last sniff times of 1-RTT packets from the pcap headers.
+
+        Unlike get_1rtt_sniff_times, neither dissects nor decrypts the trace.
+        """
+        return scan_1rtt_sniff_times(self._filename, direction)
 
     def get_vnp(self, direction: Direction = Direction.ALL) -> List:
-        return self._get_packets(
-            self._get_direction_filter(direction) + "quic.version==0"
-        )
+        return self._get_datagrams(PacketType.VERSIONNEGOTIATION, direction)
 
     def _get_long_header_packets(
         self, packet_type: PacketType, direction: Direction
     ) -> List:
-        packets = []
-        for packet in self._get_packets(
-            self._get_direction_filter(direction)
-            + "(quic.long.packet_type || quic.long.packet_type_v2)"
-        ):
-            for layer in packet.layers:
-                if layer.layer_name == "quic" and (
-                    (
-                        hasattr(layer, "long_packet_type")
-                        and layer.long_packet_type
-                        == WIRESHARK_PACKET_TYPES[packet_type]
-                    )
-                    or (
-                        hasattr(layer, "long_packet_type_v2")
-                        and layer.long_packet_type_v2
-                        == WIRESHARK_PACKET_TYPES_V2[packet_type]
-                    )
-                ):
-                    packets.append(layer)
-        return packets
+        return self.get_column("layer", packet_type, direction)
 
     def get_initial(self, direction: Direction = Direction.ALL) -> List:
         """Get all Initial packets."""
@@ -0,0 +1,70 @@
+from pathlib import Path
+import time
+
+import typer
+
+from instant_ack import config
+from instant_ack.data import convenience as cv
+from instant_ack.data import preprocess_qscanner
+from instant_ack.data import quic_pcap
+
+app = typer.Typer()
+
+# First field after the UDP header fields
+first_quic_field = quic_pcap.fields.index("quic.version")
+
+
+# tshark stops dissecting the 1-RTT packets of some connections, e.g., coalesced after a
+# Handshake packet, then its values are a prefix of the extracted values
+def is_undecrypted_by_tshark(row, ref):
+    if row[:first_quic_field] != ref[:first_quic_field] or row[-1] != ref[-1]:
+        return False
+    return all(
+        r == p or r == "" or p.startswith(f"{r},")
+        for r, p in zip(ref[first_quic_field:-1], row[first_quic_field:-1])
+    )
+
+
+# Compare in-process extraction against pcap.csv files created by tshark
+# tshark misses 1-RTT packets of some connections it fails to decrypt, these rows are counted apart
+@app.command()
+def main(
+    in_dir: Path = config.RAW_DATA_DIR / "all-interop-servers",
+    glob: str = "*/*/*/*/trace_node_left.pcap",
+    verbose: bool = False,
+):
+    identical, undecrypted, different = 0, 0, 0
+    t_extract = 0
+
+    for pcap in cv.glob_sort_folder(in_dir, glob):
+        csv = pcap.parent / "pcap.csv"
+        if not csv.is_file():
+            continue
+        with open(csv) as f:
+            reference = [line.rstrip("\n").split("|") for line in f]
+
+        start = time.perf_counter()
+        rows = quic_pcap.QuicExtractor(preprocess_qscanner.get_keylog(pcap)).process(pcap)
+        t_extract += time.perf_counter() - start
+
+        assert len(rows) == len(reference), f"Different number of frames: {pcap}"
+        for i, (row, ref) in enumerate(zip(rows, reference)):
+            if row == ref:
+                identical += 1
+            elif is_undecrypted_by_tshark(row, ref):
+                undecrypted += 1
+            else:
+                different += 1
+                if verbose:
+                    print(f"{pcap}:{i}\n  tshark: {'|'.join(ref)}\n  python: {'|'.join(row)}")
+
+    total = identical + undecrypted + different
+    print(f"{total} frames")
+    print(f"identical:                  {identical}")
+    print(f"not decrypted by tshark:    {undecrypted}")
+    print(f"different:                  {different}")
+    print(f"extraction: {t_extract:.3f} s ({total / t_extract:.0f} frames/s)")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,102 @@
+import time
+
+import numpy as np
+import polars as pl
+import typer
+
+from instant_ack.data import preprocess_qlog as pre_qlog
+
+app = typer.Typer()
+
+
+# Previous row-by-row implementation, used as reference
+def calculate_smoothed_rtt_and_variance_loop(df_samples):
+    smoothed = []
+    smoothed_n_a = []
+    rtt_var = []
+    prev = None
+    for row in df_samples[
+        [
+            "cc_smoothed_rtt",
+            "cc_adjusted_rtt",
+            "cc_current_rtt",
+            "cc_smoothed_rtt_not_adjusted",
+            "cc_rtt_var",
+        ]
+    ].iter_rows(named=True):
+        if prev is None:
+            smoothed.append(row["cc_smoothed_rtt"])
+            smoothed_n_a.append(row["cc_smoothed_rtt_not_adjusted"])
+            rtt_var.append(row["cc_rtt_var"])
+            prev = row
+            continue
+
+        rtt_var_sample = abs(prev["cc_smoothed_rtt"] - prev["cc_adjusted_rtt"])
+        row["cc_rtt_var"] = 3 / 4 * prev["cc_rtt_var"] + 1 / 4 * rtt_var_sample
+        row["cc_smoothed_rtt"] = 7 / 8 * prev["cc_smoothed_rtt"] + 1 / 8 * row["cc_adjusted_rtt"]
+        row["cc_smoothed_rtt_not_adjusted"] = (
+            7 / 8 * prev["cc_smoothed_rtt_not_adjusted"] + 1 / 8 * row["cc_current_rtt"]
+        )
+
+        smoothed.append(row["cc_smoothed_rtt"])
+        smoothed_n_a.append(row["cc_smoothed_rtt_not_adjusted"])
+        rtt_var.append(row["cc_rtt_var"])
+
+        prev = row
+
+    return df_samples.with_columns(
+        cc_smoothed_rtt=pl.Series("cc_smoothed_rtt", smoothed),
+        cc_smoothed_rtt_not_adjusted=pl.Series("cc_smoothed_rtt_not_adjusted", smoothed_n_a),
+        cc_rtt_var=pl.Series("cc_rtt_var", rtt_var),
+    )
+
+
+# Synthetic RTT samples of n_files connections, seeded as in first_smoothed_and_variance
+def generate_samples(n_files, samples_per_file, seed=0):
+    rng = np.random.default_rng(seed)
+    n = n_files * samples_per_file
+    current = rng.uniform(1, 200, n)
+    adjusted = current - rng.uniform(0, 26, n) * rng.integers(0, 2, n)
+    first = np.arange(n) % samples_per_file == 0
+
+    return pl.DataFrame(
+        {
+            "file": np.repeat([f"file_{i}" for i in range(n_files)], samples_per_file),
+            "cc_current_rtt": current,
+            "cc_adjusted_rtt": adjusted,
+        }
+    ).with_columns(
+        cc_smoothed_rtt=pl.when(pl.Series(first)).then(pl.col("cc_current_rtt")),
+        cc_smoothed_rtt_not_adjusted=pl.when(pl.Series(first)).then(pl.col("cc_current_rtt")),
+        cc_rtt_var=pl.when(pl.Series(first)).then(pl.col("cc_current_rtt") / 2),
+    )
+
+
+# Compare per-file loop against the vectorized batch, results must be bit-identical
+@app.command()
+def main(n_files: int = 2000, samples_per_file: int = 50):
+    df = generate_samples(n_files, samples_per_file)
+    cols = ["cc_smoothed_rtt", "cc_smoothed_rtt_not_adjusted", "cc_rtt_var"]
+
+    start = time.perf_counter()
+    loop = pl.concat(
+        [
+            calculate_smoothed_rtt_and_variance_loop(group)
+            for _, group in df.group_by("file", maintain_order=True)
+        ]
+    )
+    t_loop = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectorized = pre_qlog.calculate_smoothed_rtt_and_variance(df)
+    t_vectorized = time.perf_counter() - start
+
+    assert loop.select(cols).equals(vectorized.select(cols)), "Results are not bit-identical"
+
+    print(f"{n_files} files, {len(df)} samples, results bit-identical")
+    print(f"loop:       {t_loop:.3f} s")
+    print(f"vectorized: {t_vectorized:.3f} s ({t_loop / t_vectorized:.1f}x)")
+
+
+if __name__ == "__main__":
+    app()
@@ -8,6 +8,8 @@ from instant_ack.visualization import plot
 from instant_ack.data import constants as c
 from instant_ack.data import preprocess_qlog as pre_qlog
 from instant_ack.data import validation as v
+from instant_ack.data import schema
+from instant_ack.data import frames
 
 import seaborn as sns
 import matplotlib.ticker as ticker
@@ -0,0 +1,132 @@
+from pathlib import Path
+import hashlib
+import json
+import os
+import re
+
+import polars as pl
+import polars.selectors as cs
+from loguru import logger
+
+from instant_ack import config
+
+# Materialized results of lazy queries, e.g., get_measurement of the full qlog dataset
+# Keyed by the serialized query plan (filters and scanned files) and the size and modification
+# time of the scanned files, changed definitions or data never hit outdated entries
+# Least recently used entries are evicted when the cache exceeds max_size
+cache_dir = config.INTERIM_DATA_DIR / "cache"
+max_size = 10 * 2**30
+
+
+# Files scanned by a serialized plan, listed under "paths" of its scans
+def get_scanned_files(plan, scanned=False) -> list[str]:
+    if isinstance(plan, str):
+        return [plan] if scanned and os.path.isfile(plan) else []
+    if isinstance(plan, dict):
+        return [
+            file
+            for key, value in plan.items()
+            for file in get_scanned_files(value, scanned or key == "paths")
+        ]
+    if isinstance(plan, list):
+        return [file for value in plan for file in get_scanned_files(value, scanned)]
+    return []
+
+
+# Executed plans are wrapped into their resolved form and keep the resolved schema of their
+# scans, remove both to get the same key as before
+def normalize_plan(plan):
+    if isinstance(plan, dict):
+        if isinstance(plan.get("IR"), dict) and "dsl" in plan["IR"]:
+            return normalize_plan(plan["IR"]["dsl"])
+        plan = {key: normalize_plan(value) for key, value in plan.items()}
+        if "Scan" in plan and isinstance(plan["Scan"], dict):
+            scan = plan["Scan"]
+            scan["file_info"] = None
+            if isinstance(scan.get("paths"), list) and len(scan["paths"]) == 2:
+                scan["paths"][1] = False
+        return plan
+    if isinstance(plan, list):
+        return [normalize_plan(value) for value in plan]
+    return plan
+
+
+# Cache key of a query, None if the plan can not be serialized (e.g., Python functions)
+def get_key(df: pl.LazyFrame, name: str) -> str | None:
+    try:
+        plan = df.serialize(format="json")
+    except Exception as e:
+        logger.debug(f"Query not cached: {e}")
+        return None
+    # Internal version counters differ between otherwise identical plans
+    plan = normalize_plan(json.loads(re.sub(r'"version":\d+', '"version":0', plan)))
+
+    h = hashlib.blake2b(digest_size=16)
+    h.update(name.encode())
+    h.update(json.dumps(plan, sort_keys=True).encode())
+    for file in sorted(set(get_scanned_files(plan))):
+        stat = os.stat(file)
+        h.update(f"{file}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return h.hexdigest()
+
+
+def get_cache_file(name: str, key: str) -> Path:
+    return cache_dir / f"{name}-{key}.pq"
+
+
+# Result of a query, read from the cache or streamed to it
+# Enums are stored as Categoricals, parquet does not keep Enums and the ordering of
+# Categoricals, dictionary encoded columns are cast back to the dtypes of the query
+def cached(df: pl.LazyFrame, name: str) -> pl.LazyFrame:
+    key = get_key(df, name)
+    if key is None:
+        return df
+
+    file = get_cache_file(name, key)
+    if file.is_file():
+        # Mark as recently used
+        os.utime(file)
+    else:
+        write(df, file)
+        evict(keep=file)
+
+    dtypes = {
+        col: dtype
+        for col, dtype in df.collect_schema().items()
+        if isinstance(dtype, (pl.Enum, pl.Categorical))
+    }
+    return pl.scan_parquet(file).with_columns(
+        pl.col(col).cast(dtype) for col, dtype in dtypes.items()
+    )
+
+
+# Write the result of a query without holding it in memory, if the streaming engine can run it
+def write(df: pl.LazyFrame, file: Path):
+    df = df.with_columns(cs.by_dtype(pl.Enum).cast(pl.Categorical))
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    # Concurrent notebooks must not read partial files
+    tmp = f"{file}.{os.getpid()}"
+    try:
+        df.sink_parquet(tmp)
+    except pl.exceptions.InvalidOperationError:
+        df.collect().write_parquet(tmp)
+    os.replace(tmp, file)
+
+
+# Remove least recently used entries until the cache fits into max_size
+def evict(keep: Path | None = None, size: int | None = None):
+    size = max_size if size is None else size
+    files = sorted(cache_dir.glob("*.pq"), key=lambda file: file.stat().st_mtime)
+    total = sum(file.stat().st_size for file in files)
+    for file in files:
+        if total <= size:
+            break
+        if file == keep:
+            continue
+        total -= file.stat().st_size
+        file.unlink(missing_ok=True)
+
+
+def clear():
+    for file in cache_dir.glob("*.pq"):
+        file.unlink(missing_ok=True)
@@ -0,0 +1,45 @@
+from pathlib import Path
+
+import polars as pl
+
+from instant_ack.data import frames
+
+# Summary of every qlog file (connection) computed at ingest, one row per run
+# Figures that need one value per connection use it instead of the events, join runs for metadata
+time = pl.col("time_since_first_ms")
+received = pl.col("name") == "transport:packet_received"
+pto_update = pl.col("cc_pto").is_not_null()
+
+
+# Connections table of a qlog dataset, e.g. qlog/connections/qlog.aioquic.pq.zst
+def get_connections_file(dataset: Path) -> Path:
+    return Path(dataset).parent / "connections" / Path(dataset).name
+
+
+# Per connection metrics of events, keyed by group (run_id and the partition column)
+def summarize(df: pl.LazyFrame, group: list[str]) -> pl.LazyFrame:
+    df = frames.add_frame_mask(df.lazy(), "frame_frame_type", frames.qlog_frame_types)
+    stream = received & frames.has_any("STREAM")
+
+    return df.group_by(group, maintain_order=True).agg(
+        n_events=pl.len(),
+        duration_ms=time.max(),
+        # Time to first byte, the first stream frame of HTTP3 is the SETTINGS frame of the server
+        first_stream_received_ms=time.filter(stream).min(),
+        second_stream_received_ms=time.filter(stream).sort().slice(1, 1).first(),
+        first_ack_received_ms=time.filter(received & frames.has_any("ACK")).min(),
+        # As get_measurement(df, "first_pto")
+        first_pto_ms=time.filter(pto_update).min(),
+        first_pto=pl.col("cc_pto")
+        .filter(pto_update)
+        .sort_by(time.filter(pto_update), maintain_order=True)
+        .first(),
+        # As filter_samples_and_calculate_rtts, acks of packets never sent are no samples
+        n_rtt_samples=(
+            (pl.col("cc_newly_acked_ack_eliciting") == True)
+            & pl.col("cc_current_rtt").is_not_null()
+        ).sum(),
+        min_rtt=pl.col("cc_min_rtt").min(),
+        handshake_done_ms=time.filter(pl.col("handshake_done")).min(),
+        cc_handshake_done_ms=time.filter(pl.col("cc_handshake_done")).min(),
+    )
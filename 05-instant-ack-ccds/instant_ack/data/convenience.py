@@ -1,8 +1,12 @@
 from pathlib import Path
 import polars as pl
-import os
 from instant_ack import config
-import functools
+from instant_ack.data import manifest
+from instant_ack.data import storage
+from instant_ack.data import schema
+from instant_ack.data import runs
+from instant_ack.data import frames
+from instant_ack.data import cache as measurement_cache
 import numpy as np
 
 
@@ -12,9 +16,22 @@ def glob_sort_folder(folder: Path, pattern: str):
 
 
 # Convenience function to load and combine different datasets
+# qlog events are joined with their runs (metadata) lazily, with_runs=False keeps only run_id
+# columns limits the loaded columns, filters selects rows by column, e.g.
+# filters={"client": ["ngtcp2", "quiche"], "meta_name": "certificate", "rtt": (0, 100)}
+# Filtered clients and partitions are not opened, see storage.get_filter for filter values
 def load_data(
-    name, skip_missing=False, default_ext=".pq.zst", search_dir=config.INTERIM_DATA_DIR, **kwargs
+    name,
+    skip_missing=False,
+    default_ext=".pq.zst",
+    search_dir=config.INTERIM_DATA_DIR,
+    with_runs=True,
+    columns=None,
+    filters=None,
+    **kwargs,
 ):
+    filters = filters or {}
+    is_qlog = name == "qlog"
     if name == "qlog":
         name = glob_sort_folder(search_dir / name, "*.pq.zst")
     if name == "cloudflare":
@@ -27,17 +44,64 @@ def load_data(
     # Ensure respective files exists.
     existing = []
     for file in name:
-        if os.path.isfile(file):
+        if storage.dataset_exists(file):
             existing.append(file)
-        elif os.path.isfile(search_dir / f"{file}{default_ext}"):
+        elif storage.dataset_exists(search_dir / f"{file}{default_ext}"):
             existing.append(search_dir / f"{file}{default_ext}")
-        elif os.path.isfile(search_dir / f"{file}"):
+        elif storage.dataset_exists(search_dir / f"{file}"):
             existing.append(search_dir / f"{file}")
 
     if not skip_missing:
         assert len(existing) == len(name), f"Input files missing: {set(name) - set(existing)}"
 
-    return pl.concat([pl.scan_parquet(file, **kwargs) for file in existing], how="diagonal")
+    if is_qlog:
+        # qlog.<client>.pq.zst, if no client matches one dataset is scanned for the schema
+        matching = [
+            file
+            for file in existing
+            if storage.matches_filter("client", Path(file).name.split(".")[1], filters)
+        ]
+        existing = matching or existing[:1]
+        dfs = [runs.scan_events(file, with_runs, columns, filters, **kwargs) for file in existing]
+        # Datasets ingested before the frame bitmask was added compute it on load
+        dfs = [
+            frames.add_frame_mask(df, "frame_frame_type", frames.qlog_frame_types) for df in dfs
+        ]
+    else:
+        dfs = [storage.scan_dataset(file, columns, filters, **kwargs) for file in existing]
+        dfs = [frames.add_frame_mask(df) for df in dfs]
+
+    # Schemas are only reconciled if they differ
+    schemas = [df.collect_schema() for df in dfs]
+    if all(schema == schemas[0] for schema in schemas):
+        df = pl.concat(dfs, how="vertical")
+    else:
+        df = pl.concat(dfs, how="diagonal_relaxed")
+    # Dictionary encoded columns are read as Categoricals, restore Enums and lexical ordering
+    if is_qlog:
+        df = schema.apply_qlog_schema(df)
+    return df
+
+
+# Runs (one row per qlog file with its metadata) of all qlog datasets, join with events on run_id
+def load_runs(search_dir=config.INTERIM_DATA_DIR):
+    files = glob_sort_folder(search_dir / "qlog", "*.pq.zst")
+    dfs = [
+        runs.scan_runs(file) for file in files if storage.dataset_exists(runs.get_runs_file(file))
+    ]
+    return schema.apply_qlog_schema(pl.concat(dfs, how="diagonal_relaxed"))
+
+
+# Per connection metrics (time to first byte, first PTO, RTT samples, ...) of all qlog datasets
+# One row per qlog file, joined with the metadata of its run unless with_runs=False
+def load_connections(search_dir=config.INTERIM_DATA_DIR, with_runs=True):
+    files = glob_sort_folder(search_dir / "qlog", "*.pq.zst")
+    dfs = [
+        runs.scan_connections(file, with_runs=with_runs)
+        for file in files
+        if storage.dataset_exists(runs.get_runs_file(file))
+    ]
+    return schema.apply_qlog_schema(pl.concat(dfs, how="diagonal_relaxed"))
 
 
 # Packets comprising the second client flight
@@ -64,47 +128,66 @@ snd_client_flight_iack = {
 }
 
 
-# Filter input dataset to include only specific measurement
-def get_measurement(df: pl.DataFrame | pl.LazyFrame, measurement: str):
-    if measurement in ["large_certificate", "certificate"]:
-        return df.filter(
-            pl.col("meta_name") == "certificate",
-        )
+# Measurements selecting runs by their parameters, one row per accepted combination
+# Rows matching any row of the table are kept, new measurements are added with register_measurement
+measurement_params = {
+    "certificate": pl.DataFrame({"meta_name": ["certificate"]}),
+    "large_certificate": pl.DataFrame({"meta_name": ["certificate"]}),
+    "all_latencies": pl.DataFrame({"meta_name": ["all_latencies"]}),
+    "remaining_first_server_flight": pl.DataFrame(
+        {
+            "meta_pair": ["1", "1"],
+            "meta_name": ["tcdgroup2 2_3", "tcdgroup2 2_3"],
+            "meta_drop-to-client": ["2", "2_3"],
+            "server_group": ["WFC", "IACK"],
+        }
+    ),
+    # Implementations send different packets depending on server packets: WFC and IACK case
+    "second_client_flight": pl.DataFrame(
+        {
+            "client": [*snd_client_flight_wfc, *snd_client_flight_iack],
+            "meta_drop-to-server": [
+                *snd_client_flight_wfc.values(),
+                *snd_client_flight_iack.values(),
+            ],
+            "server_group": ["WFC"] * len(snd_client_flight_wfc)
+            + ["IACK"] * len(snd_client_flight_iack),
+        }
+    ),
+}
 
-    if measurement in ["all_latencies"]:
-        return df.filter(
-            pl.col("meta_name") == "all_latencies",
-        )
 
-    if measurement in ["remaining_first_server_flight"]:
-        return df.filter(
-            pl.col("meta_pair") == "1",
-            pl.col("meta_name") == "tcdgroup2 2_3",
-            (pl.col("meta_drop-to-client") == "2") & (pl.col("server_group") == "WFC")
-            | (pl.col("meta_drop-to-client") == "2_3") & (pl.col("server_group") == "IACK"),
-        )
+def register_measurement(name: str, params: pl.DataFrame):
+    measurement_params[name] = params
+
+
+# Keep rows matching a row of params (semi-join on its columns)
+# The lookup costs the same for any number of rows, unlike a chain of ORed comparisons
+def select_by_params(df: pl.DataFrame | pl.LazyFrame, params: pl.DataFrame):
+    schema = df.collect_schema()
+    # Keys take the dtypes of the dataset, values outside of Enum categories never match
+    params = params.with_columns(
+        pl.col(col).cast(schema[col], strict=False) for col in params.columns if col in schema
+    )
+    on = params.columns
+    if isinstance(df, pl.LazyFrame):
+        params = params.lazy()
+    return df.join(params, on=on, how="semi")
+
+
+# Filter input dataset to include only specific measurement
+# With cache, results of lazy inputs are stored on disk and rerunning a notebook does not scan
+# the data again, later projections and filters are then applied to the stored result
+def get_measurement(df: pl.DataFrame | pl.LazyFrame, measurement: str, cache=False):
+    df = filter_measurement(df, measurement)
+    if cache and isinstance(df, pl.LazyFrame):
+        df = measurement_cache.cached(df, measurement)
+    return df
 
-    if measurement in ["second_client_flight"]:
-        # Implementations send different packets depending on server packets: WFC and IACK case
-        wfc_or = [
-            (
-                (pl.col("client") == key)
-                & (pl.col("meta_drop-to-server") == val)
-                & (pl.col("server_group") == "WFC")
-            )
-            for key, val in snd_client_flight_wfc.items()
-        ]
-        iack_or = [
-            (
-                (pl.col("client") == key)
-                & (pl.col("meta_drop-to-server") == val)
-                & (pl.col("server_group") == "IACK")
-            )
-            for key, val in snd_client_flight_iack.items()
-        ]
-        f = functools.reduce(lambda a, b: a | b, wfc_or + iack_or)
 
-        return df.filter(f)
+def filter_measurement(df: pl.DataFrame | pl.LazyFrame, measurement: str):
+    if measurement in measurement_params:
+        return select_by_params(df, measurement_params[measurement])
 
     if measurement in ["rtt_samples"]:
         rfc_updates = (pl.col("file_size") == "10MB") & (pl.col("cc_pto") != pl.lit(None))
@@ -124,7 +207,7 @@ def get_measurement(df: pl.DataFrame | pl.LazyFrame, measurement: str):
         return df.filter(pl.col("cc_pto").is_not_null())
 
     if measurement in ["first_pto"]:
-        return get_measurement(df, "rfc_pto_updates").filter(
+        return filter_measurement(df, "rfc_pto_updates").filter(
             (pl.col("time_since_first_ms") == pl.col("time_since_first_ms").min()).over("file"),
             pl.col("meta_name") == "all_latencies",
         )
@@ -151,47 +234,60 @@ def get_theoretical_improvement(iack_improvement=4, range=np.arange(0.5, 101, 0.
     return theoretical
 
 
-# Combine two dfs with polars streaming API, to avoid exceeding the memory
-def sink_parquet_and_merge_if_exists(
-    current_df: pl.LazyFrame, new_df: pl.LazyFrame, out_file: str
-):
-    if current_df is not None:
-        # Alternative of concat empty df, breaks parquet file: https://github.com/pola-rs/polars/issues/9016
-        # requires temporary file (f"{out_file}.2"), because reading and sinking into the same file fails
-        pl.concat([current_df, new_df.lazy()], how="diagonal").sink_parquet(f"{out_file}.2")
-        os.rename(config.INTERIM_DATA_DIR / f"{out_file}.2", f"{out_file}")
-    else:
-        new_df.lazy().sink_parquet(out_file)
+# Append new data and record its files in the manifest of out_file
+# Rows of files that were processed again replace the previous rows of these files
+def sink_parquet_and_update_manifest(new_df: pl.LazyFrame, out_file: Path, partition_by: str):
+    files = new_df.lazy().select(pl.col("file").unique()).collect()["file"]
+    processed = manifest.load_manifest(out_file)
+
+    storage.migrate_dataset(out_file, partition_by)
+    storage.remove_files_from_dataset(out_file, [f for f in files if f in processed])
+    storage.append_to_dataset(new_df, out_file, partition_by)
+    manifest.save_manifest(out_file, files)
+
+
+# Running and total count of a flag within groups of consecutive rows (sorted group ids)
+# Cumulative sums restarted at the group boundaries, no group-by on the group column
+def count_in_group(flag: pl.Expr, group: str) -> tuple[pl.Expr, pl.Expr]:
+    is_first = pl.col(group).diff().fill_null(1) != 0
+    is_last = pl.col(group).diff(-1).fill_null(1) != 0
+    flag = flag.fill_null(False).cast(pl.UInt32)
+    count = flag.cum_sum()
+    running = count - pl.when(is_first).then(count - flag).forward_fill()
+    total = pl.when(is_last).then(running).backward_fill()
+    return running, total
 
 
 # Classify QUIC response frames
+# Sorted by the connection key once, connections are runs of equal keys
+# All markers are derived from counts within these runs instead of a window function each
+# Rows are returned sorted by the key, rows of a connection keep their order
 def classify_ack_and_sh_frames(df, unique):
+    initial = pl.col("quic.long.packet_type").str.contains("0")
+    _, cc_total = count_in_group(frames.has_any("CC"), "group_id")
+    sh_running, sh_total = count_in_group(pl.col("sh"), "group_id")
+    ack_running, ack_total = count_in_group(pl.col("ack"), "group_id")
     return (
-        df.with_columns(
+        frames.add_frame_mask(df)
+        .sort(unique, maintain_order=True)
+        .with_columns(group_id=pl.struct(unique).rle_id())
+        .with_columns(
             # Connection close (CC) frame
-            cc_in_group=pl.col("frame_type").str.contains("CC").any().over(unique),
+            cc_in_group=cc_total > 0,
             # ServerHello contained
-            sh=pl.col("frame_type").str.contains("CRYPTO")
-            & pl.col("quic.long.packet_type").str.contains("0")
-            & pl.col("tls.handshake.type").str.split(",").list.contains("2"),
+            sh=frames.has_any("CRYPTO")
+            & initial
+            & pl.col("tls.handshake.type").str.contains(r"(^|,)2(,|$)").fill_null(False),
             # ACK in Initial
-            ack=pl.col("frame_type").str.contains("ACK")
-            & pl.col("quic.long.packet_type").str.contains("0"),
+            ack=frames.has_any("ACK") & initial,
         )
         .with_columns(
             # Mark groups
-            sh_any=pl.col("sh").any().over(unique),
-            ack_any=pl.col("ack").any().over(unique),
-        )
-        .with_columns(
+            sh_any=sh_total > 0,
+            ack_any=ack_total > 0,
             # First ACK/SH value per group
-            # & pl.col ensures that only when a value is found, the marker is set
-            (
-                (pl.int_range(pl.len()) == pl.col("ack").arg_max()).over(unique) & pl.col("ack")
-            ).alias("ack_first"),
-            ((pl.int_range(pl.len()) == pl.col("sh").arg_max()).over(unique) & pl.col("sh")).alias(
-                "sh_first"
-            ),
+            ack_first=pl.col("ack").fill_null(False) & (ack_running == 1),
+            sh_first=pl.col("sh").fill_null(False) & (sh_running == 1),
         )
         .with_columns(
             # quic-go starts PKN at 0, Initial ACKs must ACK the first packet
@@ -206,6 +302,7 @@ def classify_ack_and_sh_frames(df, unique):
             )
             .alias("first_ack_number")
         )
+        .drop("group_id")
     )
 
 
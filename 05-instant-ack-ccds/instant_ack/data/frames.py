@@ -0,0 +1,154 @@
+import polars as pl
+
+# Frame types contained in a packet as bitmask, one bit per frame label
+# Computed once at ingest, contained frames are tested with bitwise operations instead of
+# string matching on the comma-joined frame lists of tshark (quic.frame_type) and qlog (frame_frame_type)
+mask_col = "frame_mask"
+
+# Frame type numbers as extracted by tshark (RFC9000 Section 19)
+tshark_frame_types = {
+    "0": "PAD",
+    "1": "PING",
+    "2": "ACK",
+    "3": "ACK",
+    "4": "RESET_STREAM",
+    "5": "STOP_SENDING",
+    "6": "CRYPTO",
+    "7": "NEW_TOKEN",
+    "8": "STREAM",
+    "9": "STREAM",
+    "10": "STREAM",
+    "11": "STREAM",
+    "12": "STREAM",
+    "13": "STREAM",
+    "14": "STREAM",
+    "15": "STREAM",
+    "16": "MAX_DATA",
+    "17": "MAX_STREAM_DATA",
+    "18": "MAX_STREAMS_BIDI",
+    "19": "MAX_STREAMS_UNI",
+    "20": "DATA_BLOCKED",
+    "21": "STREAM_DATA_BLOCKED",
+    "22": "STREAMS_BLOCKED_BIDI",
+    "23": "STREAMS_BLOCKED_UNI",
+    "24": "NEW_CID",
+    "25": "RETIRE_CID",
+    "26": "PATH_CHALLENGE",
+    "27": "PATH_RESPONSE",
+    "28": "CC",
+    "29": "CC",
+    "30": "HANDSHAKE_DONE",
+    "48": "DATAGRAM",
+    "49": "DATAGRAM",
+    "175": "ACK_FREQUENCY",
+}
+
+# qlog frame_type names, qlog does not distinguish the direction of stream limits
+# chrome logs crypto_frame
+qlog_frame_types = {
+    "padding": "PAD",
+    "ping": "PING",
+    "ack": "ACK",
+    "reset_stream": "RESET_STREAM",
+    "stop_sending": "STOP_SENDING",
+    "crypto": "CRYPTO",
+    "crypto_frame": "CRYPTO",
+    "new_token": "NEW_TOKEN",
+    "stream": "STREAM",
+    "max_data": "MAX_DATA",
+    "max_stream_data": "MAX_STREAM_DATA",
+    "max_streams": "MAX_STREAMS",
+    "data_blocked": "DATA_BLOCKED",
+    "stream_data_blocked": "STREAM_DATA_BLOCKED",
+    "streams_blocked": "STREAMS_BLOCKED",
+    "new_connection_id": "NEW_CID",
+    "retire_connection_id": "RETIRE_CID",
+    "path_challenge": "PATH_CHALLENGE",
+    "path_response": "PATH_RESPONSE",
+    "connection_close": "CC",
+    "handshake_done": "HANDSHAKE_DONE",
+    "datagram": "DATAGRAM",
+    "ack_frequency": "ACK_FREQUENCY",
+}
+
+# Bits are assigned in lexical order of the labels, the label of a mask is sorted like the
+# former translate_frame_types output
+labels = sorted({*tshark_frame_types.values(), *qlog_frame_types.values(), "UNKNOWN"})
+frame_bits = {label: 1 << i for i, label in enumerate(labels)}
+
+
+def get_bits(*labels) -> int:
+    bits = 0
+    for label in labels:
+        bits |= frame_bits[label]
+    return bits
+
+
+# Bitmask of a comma-joined frame list, types missing in the mapping are UNKNOWN
+# Packets without frames are 0, rows without frame list (e.g., other qlog events) stay null
+def frame_mask(col: str, types: dict) -> pl.Expr:
+    bits = {name: frame_bits[label] for name, label in types.items()}
+    return (
+        pl.col(col)
+        .cast(pl.String)
+        .str.split(",")
+        .list.eval(
+            pl.element()
+            .filter(pl.element() != "")
+            .replace_strict(bits, default=frame_bits["UNKNOWN"], return_dtype=pl.UInt32)
+        )
+        .list.unique()
+        .list.sum()
+        .cast(pl.UInt32)
+        .alias(mask_col)
+    )
+
+
+def tshark_frame_mask(col: str = "quic.frame_type") -> pl.Expr:
+    return frame_mask(col, tshark_frame_types)
+
+
+def qlog_frame_mask(col: str = "frame_frame_type") -> pl.Expr:
+    return frame_mask(col, qlog_frame_types)
+
+
+# Frame lists the ingested mask is computed from, masks of other columns are named after them
+mask_sources = ["quic.frame_type", "frame_frame_type"]
+
+
+def get_mask_col(col: str) -> str:
+    return mask_col if col in mask_sources else f"{mask_col}_{col}"
+
+
+# Add the mask of col to data ingested before it was computed, if its frame list is loaded
+def add_frame_mask(df, col: str = "quic.frame_type", types: dict = tshark_frame_types):
+    schema = df.collect_schema()
+    if get_mask_col(col) in schema or col not in schema:
+        return df
+    return df.with_columns(frame_mask(col, types).alias(get_mask_col(col)))
+
+
+# Any of the frames is contained
+def has_any(*labels, mask: str = mask_col) -> pl.Expr:
+    return (pl.col(mask) & get_bits(*labels)) != 0
+
+
+# Frames other than the given ones are contained, e.g., ack-eliciting packets
+def has_other(*labels, mask: str = mask_col) -> pl.Expr:
+    return (pl.col(mask) & ~pl.lit(get_bits(*labels), pl.UInt32)) != 0
+
+
+# Canonical label of a mask, contained frames sorted and joined by ","
+def to_label(mask: str = mask_col) -> pl.Expr:
+    return (
+        pl.when(pl.col(mask).is_not_null())
+        .then(
+            pl.concat_list(
+                pl.when((pl.col(mask) & bit) != 0).then(pl.lit(label))
+                for label, bit in frame_bits.items()
+            )
+            .list.drop_nulls()
+            .list.join(",")
+        )
+        .alias("frame_label")
+    )
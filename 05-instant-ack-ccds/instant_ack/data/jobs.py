@@ -0,0 +1,123 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+import csv
+import os
+import shlex
+import subprocess
+import time
+
+import psutil
+from loguru import logger
+from tqdm.auto import tqdm
+
+# Runs task lists of generate_task_list, one command per line, replaces GNU parallel
+# Jobs are external processes, threads only wait for them without polling
+
+# Estimated peak memory of one tshark job, limits concurrency together with the CPU count
+job_memory = 2**30
+
+# tshark reports pcaps that end within a packet, retrying them gives the same output
+truncated_message = "cut short in the middle of a packet"
+
+
+# Concurrency for procs=0: one job per CPU as long as the available memory suffices
+def get_procs(procs: int = 0, memory: int = job_memory) -> int:
+    if procs > 0:
+        return procs
+
+    by_memory = int(psutil.virtual_memory().available // memory)
+    return max(1, min(os.cpu_count() or 1, by_memory))
+
+
+# Input size of a task for throughput, the first argument is the pcap
+def get_input_size(args: list[str]) -> int:
+    if len(args) > 1 and os.path.isfile(args[1]):
+        return os.path.getsize(args[1])
+    return 0
+
+
+# The second argument is the output, e.g. pcap.csv
+def get_output(args: list[str]) -> Path | None:
+    return Path(args[2]) if len(args) > 2 else None
+
+
+# Run one task, failed jobs are repeated up to retries times
+def run_job(line: str, retries: int) -> dict:
+    args = shlex.split(line)
+    start = time.perf_counter()
+    for attempt in range(1, retries + 2):
+        p = subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        stderr = p.stderr.decode("utf-8", errors="replace")
+        if p.returncode == 0 or truncated_message in stderr:
+            break
+
+    return {
+        "task": line,
+        "exit_code": p.returncode,
+        "attempts": attempt,
+        "truncated": truncated_message in stderr,
+        "duration": time.perf_counter() - start,
+        "input_bytes": get_input_size(args),
+        "output": get_output(args),
+        "stderr": stderr.strip(),
+    }
+
+
+# Run all tasks of a task list with bounded concurrency
+# Results are written to a job log next to the task list, e.g. tl_tasks.parallel.log
+def run_task_list(task_list: Path, procs: int = 0, retries: int = 2) -> list[dict]:
+    with open(task_list) as f:
+        lines = [line.strip() for line in f if line.strip()]
+
+    procs = get_procs(procs)
+    logger.info(f"Running {len(lines)} jobs with {procs} parallel processes")
+
+    results = []
+    total_bytes = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=procs) as executor:
+        futures = [executor.submit(run_job, line, retries) for line in lines]
+        for future in (pbar := tqdm(as_completed(futures), total=len(futures))):
+            result = future.result()
+            results.append(result)
+
+            total_bytes += result["input_bytes"]
+            elapsed = time.perf_counter() - start
+            pbar.set_postfix({"MB/s": f"{total_bytes / elapsed / 1e6:.1f}"})
+
+            if result["truncated"]:
+                logger.warning(f"Truncated pcap, output kept: {result['task']}")
+            elif result["exit_code"] != 0:
+                # Existing outputs are not processed again, remove partial output of failed jobs
+                if result["output"] is not None:
+                    result["output"].unlink(missing_ok=True)
+                logger.error(
+                    f"Failed after {result['attempts']} attempts: {result['task']}\n"
+                    f"{result['stderr']}"
+                )
+
+    write_job_log(results, get_job_log(task_list))
+
+    failed = sum(result["exit_code"] != 0 and not result["truncated"] for result in results)
+    duration = sum(result["duration"] for result in results)
+    logger.info(
+        f"Finished {len(results)} jobs in {time.perf_counter() - start:.1f} s "
+        f"({duration:.1f} s job time, {total_bytes / 1e6:.1f} MB), {failed} failed"
+    )
+    return results
+
+
+def get_job_log(task_list: Path) -> Path:
+    return Path(f"{task_list}.log")
+
+
+def write_job_log(results: list[dict], log_file: Path):
+    fields = ["task", "exit_code", "attempts", "truncated", "duration", "input_bytes", "mb_s"]
+    with open(log_file, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        for result in results:
+            mb_s = result["input_bytes"] / max(result["duration"], 1e-9) / 1e6
+            writer.writerow(
+                {**result, "duration": f"{result['duration']:.3f}", "mb_s": f"{mb_s:.2f}"}
+            )
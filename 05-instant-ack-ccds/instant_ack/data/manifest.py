@@ -0,0 +1,64 @@
+from pathlib import Path
+import os
+import sqlite3
+
+import polars as pl
+
+from instant_ack.data import storage
+
+# Manifest of input files already contained in an output file, stored next to the output
+# Files are identified by path, size and modification time, changed files are processed again
+
+
+def get_manifest_file(out_file: Path) -> Path:
+    return Path(f"{out_file}.manifest.sqlite")
+
+
+# Size and modification time identify the version of a file
+def get_file_key(file) -> tuple[int, int]:
+    stat = os.stat(file)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def connect(out_file: Path) -> sqlite3.Connection:
+    con = sqlite3.connect(get_manifest_file(out_file))
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER)"
+    )
+    return con
+
+
+# Store processed files, replaces entries of files that changed
+def save_manifest(out_file: Path, files: list):
+    rows = [(str(file), *get_file_key(file)) for file in files if os.path.isfile(file)]
+    with connect(out_file) as con:
+        con.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?)", rows)
+    con.close()
+
+
+# Load manifest as dict path -> (size, mtime_ns) for O(1) lookups
+# Outputs created before manifests existed are indexed once from their file column
+# index_file is read instead, if the file column is stored in another table (see runs)
+def load_manifest(out_file: Path, refresh=False, index_file=None) -> dict[str, tuple[int, int]]:
+    manifest_file = get_manifest_file(out_file)
+    if refresh or not storage.dataset_exists(out_file):
+        manifest_file.unlink(missing_ok=True)
+        return {}
+
+    if not manifest_file.exists():
+        if index_file is None or not storage.dataset_exists(index_file):
+            index_file = out_file
+        files = storage.scan_dataset(index_file).select(pl.col("file").unique()).collect()["file"]
+        save_manifest(out_file, files)
+
+    with connect(out_file) as con:
+        rows = con.execute("SELECT path, size, mtime_ns FROM files").fetchall()
+    con.close()
+    manifest = {path: (size, mtime_ns) for path, size, mtime_ns in rows}
+    return manifest
+
+
+# True if the file is contained in the output and did not change since
+def is_processed(manifest: dict, file) -> bool:
+    key = manifest.get(str(file))
+    return key is not None and key == get_file_key(file)
@@ -3,7 +3,12 @@ import polars as pl
 from pathlib import Path
 from instant_ack import config
 from instant_ack.data import convenience as cv
-import os
+from instant_ack.data import manifest
+from instant_ack.data import storage
+from instant_ack.data import pto_info
+from instant_ack.data import schema
+from instant_ack.data import runs
+from instant_ack.data import frames
 
 
 # Extract key value elements from foldername
@@ -92,18 +97,16 @@ def add_time_since_first(df, cols="^time|cc_max_ack_sent_time$"):
 
 
 # Add marker col, when the handshake is considered done
-def add_handshake_done_markers(df):
+def add_handshake_done_markers(df, group="file"):
     return df.with_columns(
-        handshake_done=pl.col("frame_frame_type")
-        .str.contains("handshake_done")
+        handshake_done=frames.has_any("HANDSHAKE_DONE")
         .forward_fill()
-        .fill_null(False),
-        first_1rtt_ack=(
-            pl.col("frame_frame_type").str.contains("ack")
-            & (pl.col("data_header_packet_type") == "1RTT")
-        )
+        .fill_null(False)
+        .over(group),
+        first_1rtt_ack=(frames.has_any("ACK") & (pl.col("data_header_packet_type") == "1RTT"))
         .forward_fill()
-        .fill_null(False),
+        .fill_null(False)
+        .over(group),
     ).with_columns(
         # cc = custom calculation (information not provided directly by the implementations)
         cc_handshake_done=pl.col("handshake_done")
@@ -112,7 +115,7 @@ def add_handshake_done_markers(df):
 
 
 # Get RTT samples, calculate current_rtt and min_rtt
-def filter_samples_and_calculate_rtts(df):
+def filter_samples_and_calculate_rtts(df, group="file"):
 
     return (
         df.filter(
@@ -126,7 +129,7 @@ def filter_samples_and_calculate_rtts(df):
             - pl.col("cc_max_ack_sent_time_since_first_ms"),
         )
         .with_columns(
-            cc_min_rtt=pl.col("cc_current_rtt").cum_min(),
+            cc_min_rtt=pl.col("cc_current_rtt").cum_min().over(group),
         )
         .filter(
             # This ensures that skipping acks, and when acks acknowledge a packet that was never sent, the record is ignored.
@@ -145,27 +148,19 @@ RFC9002:
 """
 
 
-def first_smoothed_and_variance(df_samples):
-
-    first_acked_ack_eliciting = (
-        df_samples.filter(pl.col("cc_newly_acked_ack_eliciting") == True)
-        .select(pl.col("id").min())
-        .item(0, 0)
-    )
+def first_smoothed_and_variance(df_samples, group="file"):
+    # All samples acknowledge ack-eliciting packets, the first one of each connection is the seed
+    first_acked_ack_eliciting = pl.col("id") == pl.col("id").min().over(group)
 
     return (
         df_samples.with_columns(
-            cc_smoothed_rtt=pl.when(pl.col("id") == first_acked_ack_eliciting).then(
-                pl.col("cc_current_rtt")
-            ),
+            cc_smoothed_rtt=pl.when(first_acked_ack_eliciting).then(pl.col("cc_current_rtt")),
             # Can be used for comparison: calculation disregarding min_rtt + ack_delay rtt adjustment.
-            cc_smoothed_rtt_not_adjusted=pl.when(pl.col("id") == first_acked_ack_eliciting).then(
+            cc_smoothed_rtt_not_adjusted=pl.when(first_acked_ack_eliciting).then(
                 pl.col("cc_current_rtt")
             ),
-            cc_rtt_var=pl.when(pl.col("id") == first_acked_ack_eliciting).then(
-                pl.col("cc_current_rtt") / 2
-            ),
-            cc_first=pl.when(pl.col("id") == first_acked_ack_eliciting).then(pl.lit(True)),
+            cc_rtt_var=pl.when(first_acked_ack_eliciting).then(pl.col("cc_current_rtt") / 2),
+            cc_first=pl.when(first_acked_ack_eliciting).then(pl.lit(True)),
             # We use only a single server (quic-go), which uses 26 ms
             cc_max_ack_delay=pl.lit(26),
         )
@@ -208,100 +203,116 @@ smoothed_rtt = 7/8 * smoothed_rtt + 1/8 * adjusted_rtt
 """
 
 
-def calculate_smoothed_rtt_and_variance(df_samples):
-    smoothed = []
-    smoothed_n_a = []
-    rtt_var = []
-    prev = None
-    for row in df_samples[
-        [
-            "cc_smoothed_rtt",
-            "cc_adjusted_rtt",
-            "cc_current_rtt",
-            "cc_smoothed_rtt_not_adjusted",
-            "cc_rtt_var",
-        ]
-    ].iter_rows(named=True):
-        if prev == None:
-            # Keep first value
-            smoothed.append(row["cc_smoothed_rtt"])
-            smoothed_n_a.append(row["cc_smoothed_rtt_not_adjusted"])
-            rtt_var.append(row["cc_rtt_var"])
-            prev = row
-            continue
-
-        rtt_var_sample = abs(prev["cc_smoothed_rtt"] - prev["cc_adjusted_rtt"])
-        row["cc_rtt_var"] = 3 / 4 * prev["cc_rtt_var"] + 1 / 4 * rtt_var_sample
-        row["cc_smoothed_rtt"] = 7 / 8 * prev["cc_smoothed_rtt"] + 1 / 8 * row["cc_adjusted_rtt"]
-        row["cc_smoothed_rtt_not_adjusted"] = (
-            7 / 8 * prev["cc_smoothed_rtt_not_adjusted"] + 1 / 8 * row["cc_current_rtt"]
-        )
-
-        smoothed.append(row["cc_smoothed_rtt"])
-        smoothed_n_a.append(row["cc_smoothed_rtt_not_adjusted"])
-        rtt_var.append(row["cc_rtt_var"])
+def calculate_smoothed_rtt_and_variance(df_samples, group="file"):
+    # Both updates are EWMAs (alpha 1/8 and 1/4), the first sample of each connection is the seed.
+    # ewm_mean(adjust=False) evaluates (1 - alpha) * prev + alpha * value, i.e., the RFC9002 recurrence.
+    # Evaluated within each group, as all expressions below are windowed over group
+    first = pl.int_range(pl.len()) == 0
 
-        prev = row
+    df_samples = df_samples.with_columns(
+        cc_smoothed_rtt=pl.when(first)
+        .then(pl.col("cc_smoothed_rtt"))
+        .otherwise(pl.col("cc_adjusted_rtt"))
+        .ewm_mean(alpha=1 / 8, adjust=False)
+        .over(group),
+        cc_smoothed_rtt_not_adjusted=pl.when(first)
+        .then(pl.col("cc_smoothed_rtt_not_adjusted"))
+        .otherwise(pl.col("cc_current_rtt"))
+        .ewm_mean(alpha=1 / 8, adjust=False)
+        .over(group),
+    )
 
+    # The variance sample uses the previous smoothed_rtt and adjusted_rtt
     df_samples = df_samples.with_columns(
-        cc_smoothed_rtt=pl.Series("cc_smoothed_rtt", smoothed),
-        cc_smoothed_rtt_not_adjusted=pl.Series("cc_smoothed_rtt_not_adjusted", smoothed_n_a),
-        cc_rtt_var=pl.Series("cc_rtt_var", rtt_var),
+        cc_rtt_var_sample=(pl.col("cc_smoothed_rtt") - pl.col("cc_adjusted_rtt"))
+        .abs()
+        .shift(1)
+        .over(group),
+    ).with_columns(
+        cc_rtt_var=pl.when(first)
+        .then(pl.col("cc_rtt_var"))
+        .otherwise(pl.col("cc_rtt_var_sample"))
+        .ewm_mean(alpha=1 / 4, adjust=False)
+        .over(group),
     )
 
-    return df_samples
+    return df_samples.drop("cc_rtt_var_sample")
 
 
-def add_pto_update_on_hs_confirmed(df_samples, df):
+def add_pto_update_on_hs_confirmed(df_samples, df, group="file"):
     # Add entry when handshake is confirmed, to adjust for max_ack_delay from that point
+    # The first row of a connection with confirmed handshake, if it is not an RTT sample
     hs_confirmed = (
         df.filter(
             pl.col("cc_handshake_done"),
         )
         .filter(
-            pl.col("cc_newly_acked_ack_eliciting").is_null(), pl.col("id") == pl.col("id").min()
+            pl.col("cc_newly_acked_ack_eliciting").is_null(),
+            pl.col("id") == pl.col("id").min().over(group),
         )
-        .select("id")
+        .select(group, pl.col("id").alias("hs_confirmed"))
     )
 
-    if len(hs_confirmed) > 0:
-        insert_row = (
-            df_samples.filter(pl.col("id") < hs_confirmed.item(0, 0))
-            .tail(1)
-            .with_columns(
-                id=pl.lit(hs_confirmed.item(0, 0)).cast(pl.UInt32),
-                cc_newly_acked_ack_eliciting=pl.lit(None),
-                cc_max_ack_sent_time=pl.lit(None),
-            )
+    # Replicate the last sample before, with the id of the confirmation
+    schema = df_samples.collect_schema()
+    insert_rows = (
+        df_samples.join(hs_confirmed, on=group, how="inner")
+        .filter(pl.col("id") < pl.col("hs_confirmed"))
+        .filter(pl.col("id") == pl.col("id").max().over(group))
+        .with_columns(
+            id=pl.col("hs_confirmed"),
+            cc_newly_acked_ack_eliciting=pl.lit(None, schema["cc_newly_acked_ack_eliciting"]),
+            cc_max_ack_sent_time=pl.lit(None, schema["cc_max_ack_sent_time"]),
         )
+        .drop("hs_confirmed")
+    )
 
-        df_samples = pl.concat([df_samples, insert_row]).sort("id")
-
-    return df_samples
-
-
-def calculate_ptos(df):
-    df = add_handshake_done_markers(df)
+    return pl.concat([df_samples, insert_rows]).sort("id")
+
+
+# Columns added by calculate_ptos
+pto_cols = [
+    "cc_smoothed_rtt",
+    "cc_smoothed_rtt_not_adjusted",
+    "cc_rtt_var",
+    "cc_current_rtt",
+    "cc_min_rtt",
+    "cc_first",
+    "cc_max_ack_delay",
+    "cc_ack_delay_adjusted",
+    "cc_adjusted_rtt",
+    "cc_pto",
+    "cc_pto_not_adjusted",
+    "cc_potentially_ignored_sample",
+]
+marker_cols = ["handshake_done", "first_1rtt_ack", "cc_handshake_done", "cc_kGranularity"]
+
+
+# Calculate RTT estimates and PTOs of all connections at once, connections are keyed by group
+# Rows of a connection must be contiguous and in the order of its qlog file
+def calculate_ptos(df, group="file"):
+    lazy = isinstance(df, pl.LazyFrame)
+    df = df.lazy()
+    df = add_handshake_done_markers(df, group)
     # Add ID and global granularity
     df = df.with_columns(
         cc_kGranularity=pl.lit(1),  # ms
     ).with_row_index("id")
 
-    # If no markers added skip
-    if ("cc_newly_acked_ack_eliciting" not in df) or (
-        df.select(pl.col("cc_newly_acked_ack_eliciting").any()).item(0, 0) == False
-    ):
-        return df
+    # Files extracted without add-pto-info have no samples
+    if "cc_newly_acked_ack_eliciting" not in df.collect_schema():
+        df = df.drop("id")
+        return df if lazy else df.collect()
 
-    df_samples = filter_samples_and_calculate_rtts(df)
+    df_samples = filter_samples_and_calculate_rtts(df, group)
 
     # Seed smoothed_rtt and rtt variance
-    df_samples = first_smoothed_and_variance(df_samples)
+    df_samples = first_smoothed_and_variance(df_samples, group)
 
-    df_samples = calculate_smoothed_rtt_and_variance(df_samples)
+    df_samples = calculate_smoothed_rtt_and_variance(df_samples, group)
 
     # This adds an additional datapoint replicating the previous, but updating PTO when the handshake is confirmed.
-    df_samples = add_pto_update_on_hs_confirmed(df_samples, df)
+    df_samples = add_pto_update_on_hs_confirmed(df_samples, df, group)
 
     df_samples = df_samples.with_columns(cc_rtt_var_4=pl.col("cc_rtt_var") * 4).with_columns(
         cc_pto=pl.when(pl.col("cc_handshake_done") == False)
@@ -326,27 +337,19 @@ def calculate_ptos(df):
     )
 
     # Join the following columns
-    cols = [
-        "cc_smoothed_rtt",
-        "cc_smoothed_rtt_not_adjusted",
-        "cc_rtt_var",
-        "cc_current_rtt",
-        "cc_min_rtt",
-        "cc_first",
-        "cc_max_ack_delay",
-        "cc_ack_delay_adjusted",
-        "cc_adjusted_rtt",
-        "cc_pto",
-        "cc_pto_not_adjusted",
-        "cc_potentially_ignored_sample",
-        "id",
-    ]
-
-    return df.join(
-        df_samples[cols],
+    df = df.join(
+        df_samples.select(pto_cols + ["id"]),
         on="id",
         how="left",
     ).drop(["id"])
+    return df if lazy else df.collect()
+
+
+# Recalculate PTOs of ingested data, e.g., of cv.load_data("qlog") after changing the calculation
+# Connections are made contiguous, the order of events within a file is kept
+def recalculate_ptos(df, group="file"):
+    df = df.drop(pto_cols + marker_cols, strict=False).sort(group, maintain_order=True)
+    return calculate_ptos(df, group)
 
 
 def adjust_rtt_vals(df, client):
@@ -355,22 +358,31 @@ def adjust_rtt_vals(df, client):
     return df.with_columns(pl.col("data_min_rtt", "data_smoothed_rtt", "data_latest_rtt") / 10**3)
 
 
-def remove_unused_cols(df, client):
+# Columns the pipeline does not use, these are not materialized when scanning qlog files
+unused_cols = [
+    "meta_trace_common_fields_time_format",
+    "common_fields_reference_time",
+    "vantage_point_name",
+    "vantage_point_type",
+]
+# picoquic logs unknown transport parameters as data_XX hex columns
+c_unused_cols_pattern = {"picoquic": "^data_[0-9a-f]{2,4}$"}
 
-    remove_cols = [
-        "meta_trace_common_fields_time_format",
-        "common_fields_reference_time",
-    ]
-    generic_remove = ["vantage_point_name", "vantage_point_type", "time"]
 
-    if client == "picoquic":
-        remove_cols += list(
-            pl.DataFrame({"cols": df.columns}).filter(
-                pl.col("cols").str.contains("^data_[0-9a-f]{2,4}$")
+def get_unused_cols(columns, client):
+    cols = [col for col in unused_cols if col in columns]
+    if client in c_unused_cols_pattern:
+        cols += list(
+            pl.DataFrame({"cols": columns}, schema={"cols": pl.String}).filter(
+                pl.col("cols").str.contains(c_unused_cols_pattern[client])
             )["cols"]
         )
+    return cols
 
-    return df.drop(remove_cols + generic_remove, strict=False)
+
+def remove_unused_cols(df, client):
+    # time is replaced by time_since_first_ms
+    return df.drop(get_unused_cols(df.columns, client) + ["time"], strict=False)
 
 
 def convert_dtypes(df, client):
@@ -415,12 +427,68 @@ def scale_recovery_metrics(df, client):
     return df
 
 
+# Detect qlog serialization: JSON array, newline delimited JSON or JSON text sequences (RFC7464)
+def get_qlog_format(file):
+    with open(file, "rb") as f:
+        start = f.read(4096).lstrip()
+    if start.startswith(b"["):
+        return "json"
+    if start.startswith(b"\x1e"):
+        return "json-seq"
+    return "ndjson"
+
+
+# Lazily read a qlog file, columns unused by the pipeline are not materialized
+def scan_qlog(file, client, infer_schema_length=100):
+    schema_overrides = get_client_schema(client)
+    fmt = get_qlog_format(file)
+
+    if fmt == "json":
+        # JSON arrays can not be scanned, these are parsed completely
+        df = pl.read_json(
+            file, schema_overrides=schema_overrides, infer_schema_length=infer_schema_length
+        )
+        return df.lazy().drop(get_unused_cols(df.columns, client))
+
+    if fmt == "json-seq":
+        # Strip record separators, the remainder is newline delimited JSON
+        with open(file, "rb") as f:
+            data = f.read().replace(b"\x1e", b"")
+        df = pl.read_ndjson(data)
+        return (
+            df.lazy()
+            .drop(get_unused_cols(df.columns, client))
+            .with_columns(
+                pl.col(col).cast(dtype)
+                for col, dtype in schema_overrides.items()
+                if col in df.columns
+            )
+        )
+
+    schema = pl.scan_ndjson(file, infer_schema_length=infer_schema_length).collect_schema()
+    overrides = {col: dtype for col, dtype in schema_overrides.items() if col in schema}
+    # The ndjson parser yields null for non-string values of String fields, cast these afterwards
+    casts = {col: dtype for col, dtype in overrides.items() if dtype == pl.String}
+    schema.update({col: dtype for col, dtype in overrides.items() if col not in casts})
+    for col in get_unused_cols(schema.names(), client):
+        del schema[col]
+
+    # Fields missing in the schema are skipped by the parser
+    return pl.scan_ndjson(file, schema=schema).with_columns(
+        pl.col(col).cast(dtype) for col, dtype in casts.items()
+    )
+
+
 # Process a single qlog file
 def process_qlog(file):
     meta = extract_run_meta(file)
     c = meta["client"]
 
-    df = pl.read_json(file, schema_overrides=get_client_schema(c))
+    df = scan_qlog(file, c).with_columns(frames.qlog_frame_mask()).collect()
+
+    # Files extracted without add-pto-info lack the linking of sent and received packets
+    if pto_info.custom_newly_acked not in df.columns:
+        df = pto_info.add_pto_info(df)
 
     df = df.with_columns(
         # Convert time and cc_mack_sent_time to ms.
@@ -440,7 +508,6 @@ def process_qlog(file):
     df = add_time_since_first(df)
     df = rename_recovery_metric_update(df)
     df = scale_recovery_metrics(df, c)
-    df = calculate_ptos(df)
 
     # Scale recovery_metric updates uniformly
     df = adjust_rtt_vals(df, c)
@@ -458,7 +525,7 @@ ia = "instant-ack"
 
 
 # Process a folder produced by QIR
-def folder_to_df(folder: Path, df_files: pl.DataFrame) -> pl.DataFrame:
+def folder_to_df(folder: Path, processed: dict) -> pl.DataFrame:
 
     folder_meta = extract_key_val(folder.parts[-1])
     meta = (
@@ -476,7 +543,7 @@ def folder_to_df(folder: Path, df_files: pl.DataFrame) -> pl.DataFrame:
     dfs = []
     for file in (bar := tqdm(files, leave=False)):
         bar.set_postfix({"file": file.parts[-1]}, refresh=True)
-        if str(file) in df_files["file"]:
+        if manifest.is_processed(processed, file):
             continue
         df = process_qlog(file)
 
@@ -484,21 +551,33 @@ def folder_to_df(folder: Path, df_files: pl.DataFrame) -> pl.DataFrame:
     if len(dfs) > 0:
         iack = (ia in folder_meta) and (fpd not in folder_meta)
         wfc = (ia not in folder_meta) and (fpd in folder_meta)
+        # PTOs of all files of the folder are calculated at once
         df = (
-            pl.concat(dfs, how="diagonal")
+            calculate_ptos(pl.concat(dfs, how="diagonal"))
             .join(meta, how="cross")
             .with_columns(
                 server_group=pl.when(iack)
                 .then(pl.lit("IACK"))
                 .when(wfc)
                 .then(pl.lit("WFC"))
-                .otherwise(pl.lit(None))
+                .otherwise(pl.lit(None)),
+                folder=pl.lit(str(folder)),
             )
         )
-        return df
+        return schema.apply_qlog_schema(df)
     return None
 
 
+# Process a folder in a worker process and write the result into its own parquet fragment
+def folder_to_fragment(folder: Path, processed: dict, fragment: Path) -> Path:
+    df = folder_to_df(folder, processed)
+    if df is None:
+        return None
+
+    df.write_parquet(fragment)
+    return fragment
+
+
 def get_client_schema(client: str):
     schema = {
         "data_grease_quic_bit": pl.String,
@@ -525,11 +604,10 @@ def get_client_schema(client: str):
     return schema
 
 
-# Get information of already parsed files or empty dataframe if not yet parsed
-# This allows incrementally combining information into a single parquet file
+# Get manifest of already parsed files, or an empty manifest if not yet parsed
+# This allows incrementally appending information to the partitioned dataset
 def get_files_if_dest_exists(dest: Path, refresh=False):
-    parquet_file = dest
-    if os.path.exists(parquet_file) and (refresh == False):
-        df = pl.scan_parquet(parquet_file)
-        return df.select("file").unique("file").collect(), df
-    return pl.DataFrame({"file": []}, schema_overrides={"file": pl.String}), None
+    if refresh:
+        storage.remove_dataset(dest)
+        runs.remove_runs(dest)
+    return manifest.load_manifest(dest, refresh=refresh, index_file=runs.get_runs_file(dest))
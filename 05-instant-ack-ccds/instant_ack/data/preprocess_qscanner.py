@@ -1,92 +1,198 @@
 import polars as pl
+import pyarrow.parquet as pq
+from loguru import logger
+from instant_ack import config
 from instant_ack.data import convenience as cv
+from instant_ack.data import manifest
+from instant_ack.data import storage
+from instant_ack.data import quic_pcap
+from instant_ack.data import targets as tg
+from instant_ack.data import frames
+from instant_ack.data import jobs
+import json
 import os
 from tqdm.auto import tqdm
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+import subprocess
+import tempfile
+from itertools import islice
 
 
-# Read target file that includes quic.scid to join domains
-def read_targets(file):
-    schema = {
-        "scid": pl.String,
-    }
-    usecols = ["scid", "sni"]
+# Fields extracted by tools/tshark-extract-quic-fields.sh
+parsed_names = [
+    "ts",
+    "ip.src",
+    "ip.dst",
+    "udp.length",
+    "udp.srcport",
+    "udp.dstport",
+    "quic.version",
+    "quic.long.packet_type",
+    "quic.scid",
+    "quic.dcid",
+    "quic.frame_type",
+    "quic.ack.ack_delay",
+    "quic.ack.ack_range",
+    "quic.ack.first_ack_range",
+    "tls.quic.parameter.ack_delay_exponent",
+    "tls.handshake.type",
+    "tls.handshake.extensions_server_name",
+    "ip.ttl",
+]
 
-    df = pl.read_csv(file, schema_overrides=schema).select(usecols).drop_nulls().lazy()
-    return df
+parsed_schema = {
+    "ip.src": pl.String,
+    "ip.dst": pl.String,
+    "udp.length": pl.UInt16,
+    "udp.srcport": pl.UInt16,
+    "udp.dstport": pl.UInt16,
+    "protocol": pl.String,
+    "info": pl.String,
+    "quic.version": pl.String,
+    "quic.crypto.length": pl.Int64,
+    "quic.padding_length": pl.Int64,
+    "quic.long.packet_type": pl.String,
+    "quic.connection.number": pl.Int64,
+    "quic.fixed_bit": pl.String,
+    "quic.packet_length": pl.String,
+    "quic.packet_number": pl.Int64,
+    "quic.scid": pl.String,
+    "quic.dcid": pl.String,
+    "quic.length": pl.String,
+    "quic.ack.ack_delay": pl.String,
+    "quic.ack.ack_range": pl.String,
+    "quic.ack.first_ack_range": pl.String,
+    "tls.handshake.type": pl.String,
+    "tls.quic.parameter.ack_delay_exponent": pl.UInt32,
+    "ip.ttl": pl.String,
+    "ts": pl.Datetime("us"),
+}
 
 
 def load_parsed(fname, **kwargs):
-
-    names = [
-        "ts",
-        "ip.src",
-        "ip.dst",
-        "udp.length",
-        "udp.srcport",
-        "udp.dstport",
-        "quic.version",
-        "quic.long.packet_type",
-        "quic.scid",
-        "quic.dcid",
-        "quic.frame_type",
-        "quic.ack.ack_delay",
-        "quic.ack.ack_range",
-        "quic.ack.first_ack_range",
-        "tls.quic.parameter.ack_delay_exponent",
-        "tls.handshake.type",
-        "tls.handshake.extensions_server_name",
-        "ip.ttl",
-    ]
-
-    schema = {
-        "ip.src": pl.String,
-        "ip.dst": pl.String,
-        "udp.length": pl.UInt16,
-        "udp.srcport": pl.UInt16,
-        "udp.dstport": pl.UInt16,
-        "protocol": pl.String,
-        "info": pl.String,
-        "quic.version": pl.String,
-        "quic.crypto.length": pl.Int64,
-        "quic.padding_length": pl.Int64,
-        "quic.long.packet_type": pl.String,
-        "quic.connection.number": pl.Int64,
-        "quic.fixed_bit": pl.String,
-        "quic.packet_length": pl.String,
-        "quic.packet_number": pl.Int64,
-        "quic.scid": pl.String,
-        "quic.dcid": pl.String,
-        "quic.length": pl.String,
-        "quic.ack.ack_delay": pl.String,
-        "quic.ack.ack_range": pl.String,
-        "quic.ack.first_ack_range": pl.String,
-        "tls.handshake.type": pl.String,
-        "tls.quic.parameter.ack_delay_exponent": pl.UInt32,
-        "ip.ttl": pl.String,
-        "ts": pl.Datetime("us"),
-    }
-
     df = pl.scan_csv(
         fname,
         separator="|",
         has_header=False,
-        new_columns=names,
+        new_columns=parsed_names,
         low_memory=True,
-        schema_overrides=schema,
+        schema_overrides=parsed_schema,
         **kwargs,
     ).with_columns(pl.col("quic.version").str.split(",").list.get(0))
     return df
 
 
+# Parse a batch of extracted lines as load_parsed, all columns are typed to keep batches uniform
+def read_parsed(lines: bytes) -> pl.DataFrame:
+    schema = {name: parsed_schema.get(name, pl.String) for name in parsed_names}
+    df = pl.read_csv(
+        lines,
+        separator="|",
+        has_header=False,
+        schema=schema,
+    ).with_columns(
+        pl.col("quic.version").str.split(",").list.get(0),
+        # As in load_parsed, schema columns that are not extracted are added empty
+        *[
+            pl.lit(None, dtype).alias(name)
+            for name, dtype in parsed_schema.items()
+            if name not in schema
+        ],
+    )
+    return df
+
+
+# Packet table written next to a trace by the TraceAnalyzer of the interop runner
+# e.g. trace_node_left.pcap -> trace_node_left.packets.parquet
+def get_sidecar(pcap):
+    return pcap.with_suffix(".packets.parquet")
+
+
+# Format of the sidecar, SIDECAR_VERSION of the interop runner
+sidecar_version = 3
+
+
+# Size and modification time of a file as recorded in the sidecar, None if missing
+def get_file_stat(file):
+    try:
+        stat = os.stat(file)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+# The sidecar replaces extraction if it was written for this pcap and decrypted with the
+# keylog the extraction script uses, stale or differently decrypted sidecars are ignored
+def is_valid_sidecar(pcap) -> bool:
+    sidecar = get_sidecar(pcap)
+    if not sidecar.is_file():
+        return False
+    metadata = pq.read_schema(sidecar).metadata or {}
+    key = json.loads(metadata.get(b"trace", b"{}"))
+    return (
+        key.get("version") == sidecar_version
+        and key.get("trace") == get_file_stat(pcap)
+        and key.get("keylog") == get_file_stat(get_keylog(pcap))
+    )
+
+
+# Fields of a datagram, repeated for its coalesced QUIC packets in the sidecar
+sidecar_datagram_fields = [
+    "ip.src",
+    "ip.dst",
+    "udp.length",
+    "udp.srcport",
+    "udp.dstport",
+    "ip.ttl",
+]
+
+
+# Load the sidecar of a trace as load_parsed, without dissecting the pcap again
+# The sidecar has one row per QUIC packet and per other frame, fields of coalesced packets are
+# joined per frame like the extraction script does
+def load_sidecar(fname, **kwargs):
+    epoch = pl.col("frame.time_epoch").str.split(".")
+    df = pl.scan_parquet(fname, **kwargs).rename({"version": "quic.version", "scid": "quic.scid"})
+    packet_fields = [name for name in parsed_names if name not in sidecar_datagram_fields + ["ts"]]
+    return (
+        df.group_by("packet", maintain_order=True)
+        .agg(
+            pl.col("frame.time_epoch", *sidecar_datagram_fields).first(),
+            pl.col(packet_fields).cast(pl.String).drop_nulls().str.join(","),
+        )
+        .select(
+            pl.from_epoch(
+                epoch.list.get(0).cast(pl.Int64) * 1_000_000
+                + epoch.list.get(1).str.slice(0, 6).str.pad_end(6, "0").cast(pl.Int64),
+                time_unit="us",
+            ).alias("ts"),
+            *[
+                # As empty fields of the csv
+                pl.when(pl.col(name) != "")
+                .then(pl.col(name))
+                .cast(parsed_schema.get(name, pl.String))
+                for name in parsed_names
+                if name != "ts"
+            ],
+        )
+        .with_columns(pl.col("quic.version").str.split(",").list.get(0))
+    )
+
+
+# Try to find keylog file of a pcap
+def get_keylog(pcap):
+    keylog = str(pcap.parent / ".." / "client" / "keys.log")
+    if not os.path.isfile(keylog):
+        keylog = str(pcap.parent / "key.log")
+    return keylog
+
+
 # Generates parameterized task list for parallel
 def generate_task_list(source, dest):
     with open(dest, "w") as file:
         for pcap in source[::-1]:
-
-            # Tyry to find keylog file
-            keylog = str(pcap.parent / ".." / "client" / "keys.log")
-            if not os.path.isfile(keylog):
-                keylog = str(pcap.parent / "key.log")
+            keylog = get_keylog(pcap)
 
             out_file = pcap.parent / "pcap.csv"
             # Do not reprocess pcaps
@@ -96,100 +202,180 @@ def generate_task_list(source, dest):
             file.write(line)
 
 
+# Extract fields in-process instead of running tshark, writes the same pcap.csv files
+def extract_all_files(source, procs):
+    tasks = [
+        (pcap, pcap.parent / "pcap.csv", get_keylog(pcap))
+        for pcap in source[::-1]
+        # Do not reprocess pcaps
+        if not os.path.isfile(pcap.parent / "pcap.csv")
+    ]
+
+    # polars is not fork-safe, use spawned processes
+    with ProcessPoolExecutor(
+        max_workers=procs, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        futures = [executor.submit(quic_pcap.write_quic_fields, *task) for task in tasks]
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            future.result()
+
+
+# Add metadata derived from the path of the measurement and look up domains of targets
+# file is the pcap.csv of the measurement, also if the pcap was streamed without it
+def add_metadata(df, file, targets):
+    return (
+        df.with_columns(
+            file=pl.lit(str(file.parent / "pcap.csv")),
+            location=pl.lit(str(file.parts[-4])),
+            measurement_ts=pl.lit(str(file.parts[-2])),
+        )
+        .with_columns(
+            pl.col("measurement_ts").str.replace_all(",", ".").str.to_datetime(),
+            pl.col(["quic.dcid", "quic.scid"]).str.split(",").list.get(0, null_on_oob=True),
+            frames.tshark_frame_mask(),
+        )
+        .with_columns(
+            tg.lookup_sni(targets),
+            pl.when(pl.col("udp.dstport") == 443)
+            .then(pl.lit("requests"))
+            .otherwise(pl.lit("responses"))
+            .alias("kind"),
+        )
+    )
+
+
 # Read extracted information and save into parquet file
 def process_all_files(files, out_file, refresh=False):
-    current_df = None
-    current_files = []
-
-    if os.path.isfile(out_file) and not refresh:
-        current_df = pl.scan_parquet(out_file)
-        current_files = current_df.select("file").unique().collect()
+    if refresh:
+        storage.remove_dataset(out_file)
+    processed = manifest.load_manifest(out_file, refresh=refresh)
 
     dfs = []
     for csv in (pbar := tqdm(files)):
         pbar.set_postfix({"file": csv})
-        if csv in current_files:
+        if manifest.is_processed(processed, csv):
             continue
 
-        targets = csv.parent / "targets.zst"
-        targets = read_targets(targets)
-
-        df = load_parsed(csv)
-        # Add metadata
-        df = (
-            df.with_columns(
-                file=pl.lit(str(csv)),
-                location=pl.lit(str(csv.parts[-4])),
-                measurement_ts=pl.lit(str(csv.parts[-2])),
-            )
-            .with_columns(
-                pl.col("measurement_ts").str.replace_all(",", ".").str.to_datetime(),
-                pl.col(["quic.dcid", "quic.scid"]).str.split(",").list.get(0, null_on_oob=True),
-            )
-            .join(targets, how="left", left_on="quic.dcid", right_on="scid")
-            .join(targets, how="left", left_on="quic.scid", right_on="scid", suffix="_scid")
-            .with_columns(
-                pl.coalesce(pl.col(["sni", "sni_scid"])).alias("sni"),
-                pl.when(pl.col("udp.dstport") == 443)
-                .then(pl.lit("requests"))
-                .otherwise(pl.lit("responses"))
-                .alias("kind"),
-            )
-            .drop(
-                "sni_scid",
-            )
-        )
+        targets = tg.load_targets(csv.parent / "targets.zst")
 
+        df = add_metadata(load_parsed(csv), csv, targets)
         dfs.append(df)
+
+    if len(dfs) == 0:
+        return
     df = pl.concat(dfs, how="diagonal")
-    cv.sink_parquet_and_merge_if_exists(current_df, df, out_file)
+    cv.sink_parquet_and_update_manifest(df, out_file, partition_by="location")
+
+
+# Lines per batch read from the extraction output
+batch_size = 100_000
+
+
+# Extracted lines of a pcap in batches, tshark writes to its stdout instead of a pcap.csv
+# As run_job, output of truncated pcaps is kept, other failures raise CalledProcessError
+def iter_extracted_lines(pcap, keylog, backend):
+    if backend == "python":
+        rows = quic_pcap.QuicExtractor(keylog).iter_rows(pcap)
+        while batch := list(islice(rows, batch_size)):
+            yield "".join("|".join(row) + "\n" for row in batch).encode()
+        return
+
+    script = config.PROJ_ROOT / "tools" / "tshark-extract-quic-fields.sh"
+    # stderr is read after tshark exited, a file does not block it like a full pipe
+    with tempfile.TemporaryFile() as stderr:
+        with subprocess.Popen(
+            [script, pcap, "/dev/stdout", keylog], stdout=subprocess.PIPE, stderr=stderr
+        ) as p:
+            while lines := list(islice(p.stdout, batch_size)):
+                yield b"".join(lines)
+
+        stderr.seek(0)
+        message = stderr.read().decode("utf-8", errors="replace")
+    if jobs.truncated_message in message:
+        logger.warning(f"Truncated pcap, output kept: {pcap}")
+    elif p.returncode != 0:
+        raise subprocess.CalledProcessError(p.returncode, p.args, stderr=message.strip())
+
+
+# Write extracted fields of a pcap as parquet fragment of its location
+# Batches are parsed and written one by one, the output of a pcap is never held in memory at once
+# Returns whether the extraction finished, the fragment of a failed extraction is discarded
+def stream_file(pcap, out_file, name, backend) -> bool:
+    targets = tg.load_targets(pcap.parent / "targets.zst")
+
+    writer = None
+    finished = False
+    try:
+        for lines in iter_extracted_lines(pcap, get_keylog(pcap), backend):
+            df = add_metadata(read_parsed(lines).lazy(), pcap, targets).drop("location").collect()
+            table = df.to_arrow()
+            if writer is None:
+                folder = storage.get_partition_dir(out_file, "location", pcap.parts[-4])
+                fragment = folder / f"{name}.pq"
+                writer = pq.ParquetWriter(f"{fragment}.tmp", table.schema, compression="zstd")
+            writer.write_table(table.cast(writer.schema))
+        finished = True
+    except subprocess.CalledProcessError as e:
+        logger.warning(f"tshark exited with {e.returncode}: {pcap}\n{e.stderr}")
+    except Exception as e:
+        # Other pcaps are still processed, this one is tried again in the next run
+        logger.error(f"Extraction failed: {pcap}: {e!r}")
+    finally:
+        # Empty parquet files break reading, pcaps without packets have no fragment
+        if writer is not None:
+            writer.close()
+            if finished:
+                os.replace(f"{fragment}.tmp", fragment)
+            else:
+                os.remove(f"{fragment}.tmp")
+    return finished
+
+
+# Stream pcaps into the dataset without intermediate pcap.csv files
+# Files are recorded in the manifest as they complete, interrupted runs continue where they stopped
+# and pcaps whose extraction failed are tried again in the next run
+def stream_all_files(source, out_file, procs, backend, refresh=False):
+    if refresh:
+        storage.remove_dataset(out_file)
+    processed = manifest.load_manifest(out_file, refresh=refresh)
+
+    pcaps = [pcap for pcap in source if not manifest.is_processed(processed, pcap)]
+    if len(pcaps) == 0:
+        return
+
+    # Rows of changed pcaps, also if they were added from their pcap.csv before
+    stale = [
+        str(file)
+        for pcap in pcaps
+        if str(pcap) in processed or str(pcap.parent / "pcap.csv") in processed
+        for file in (pcap, pcap.parent / "pcap.csv")
+    ]
+    storage.migrate_dataset(out_file, "location")
+    storage.remove_files_from_dataset(out_file, stale)
+
+    run = storage.get_run()
+    # polars is not fork-safe, use spawned processes
+    with ProcessPoolExecutor(
+        max_workers=procs, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        futures = {
+            executor.submit(stream_file, pcap, out_file, f"{run}-{i:06d}", backend): pcap
+            for i, pcap in enumerate(pcaps)
+        }
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            if future.result():
+                manifest.save_manifest(out_file, [futures[future]])
 
 
 # Make contained frame types human readable
-frame_types = {
-    "0": "PAD",
-    "1": "PING",
-    "2": "ACK",
-    "3": "ACK",
-    "4": "RESET_STREAM",
-    "5": "STOP_SENDING",
-    "6": "CRYPTO",
-    "7": "NEW_TOKEN",
-    "8": "STREAM",
-    "9": "STREAM",
-    "10": "STREAM",
-    "11": "STREAM",
-    "12": "STREAM",
-    "13": "STREAM",
-    "14": "STREAM",
-    "15": "STREAM",
-    "16": "MAX_DATA",
-    "18": "MAX_STREAMS_BIDI",
-    "24": "NEW_CID",
-    "25": "STREAMS_BLOCKED_UNI",
-    "26": "PATH_CHALLENGE",
-    "28": "CC",
-    "29": "CC",
-    "30": "HANDSHAKE_DONE",
-}
+frame_types = frames.tshark_frame_types
 
 
+# Canonical label of the contained frame types, e.g., "ACK,CRYPTO"
+# Derived from the frame bitmask, which is computed first if not ingested yet
 def translate_frame_types(df, col, new_col):
-    return df.with_columns(
-        # Split and replace with readable frame_type
-        # Sort to shift ACK to the front and disregard order
-        pl.col(col)
-        .str.split(",")
-        .list.eval(
-            pl.element().replace_strict(
-                frame_types,
-            )
-        )
-        .list.unique()
-        .list.sort()
-        .list.join(",")
-        .alias(new_col)
-    )
+    df = frames.add_frame_mask(df, col)
+    return df.with_columns(frames.to_label(frames.get_mask_col(col)).alias(new_col))
 
 
 # Converts city names and Vantage points information
@@ -0,0 +1,126 @@
+import numpy as np
+import polars as pl
+
+from instant_ack.data import frames
+
+# Link sent and received packets of a qlog file, replaces the add-pto-info tool (04-go-pto-tool)
+# cc = custom calculation (information not provided directly by the implementations)
+qlog_name_sent = "transport:packet_sent"
+qlog_name_received = "transport:packet_received"
+custom_time_param = "cc_max_ack_sent_time"
+custom_newly_acked = "cc_newly_acked_ack_eliciting"
+
+# Packet number spaces
+pkn_spaces = ["initial", "handshake", "1RTT"]
+
+
+# Packets sent per packet number space, a later packet with the same number replaces the former
+def get_sent_packets(df):
+    return (
+        df.filter(
+            pl.col("name") == qlog_name_sent,
+            pl.col("data_header_packet_type").is_in(pkn_spaces),
+        )
+        .select(
+            pl.col("data_header_packet_type").alias("space"),
+            pl.col("data_header_packet_number").cast(pl.UInt64).alias("pkn"),
+            pl.col("time").alias(custom_time_param),
+            # Packets that contain other frames than ACK and PADDING
+            frames.has_other("ACK", "PAD").fill_null(False).alias("ack_eliciting"),
+        )
+        .unique(["space", "pkn"], keep="last", maintain_order=True)
+        .sort(["space", "pkn"])
+    )
+
+
+# Parse acked ranges of received packets, e.g., "[[3,5],[0,1]],"
+# As add-pto-info, only the first range is expanded, the largest acknowledged is the maximum of all ranges
+def get_ack_ranges(df):
+    return (
+        df.filter(
+            pl.col("name") == qlog_name_received,
+            pl.col("data_header_packet_type").is_in(pkn_spaces),
+        ).select(
+            "id",
+            pl.col("data_header_packet_type").alias("space"),
+            pl.col("frame_acked_ranges")
+            .str.extract(r"(\d+),?(\d+)?", 1)
+            .cast(pl.UInt64, strict=False)
+            .alias("ack_min"),
+            pl.coalesce(
+                pl.col("frame_acked_ranges").str.extract(r"(\d+),?(\d+)?", 2),
+                pl.col("frame_acked_ranges").str.extract(r"(\d+),?(\d+)?", 1),
+            )
+            .cast(pl.UInt64, strict=False)
+            .alias("ack_max"),
+            pl.col("frame_acked_ranges")
+            .str.extract_all(r"\d+")
+            .list.eval(pl.element().cast(pl.UInt64, strict=False))
+            .list.max()
+            .alias("pkn"),
+        )
+        # Empty ranges are ignored
+        .filter(pl.col("ack_min") <= pl.col("ack_max"))
+    )
+
+
+# Index of the first ACK range acknowledging each sent packet, or -1 if never acknowledged
+# Each packet is marked once, skipping marked packets via path compression (interval-set union)
+def first_acknowledgment(n_sent, starts, ends):
+    first = np.full(n_sent, -1, dtype=np.int64)
+    nxt = list(range(n_sent + 1))
+
+    def find(i):
+        root = i
+        while nxt[root] != root:
+            root = nxt[root]
+        while nxt[i] != root:
+            nxt[i], i = root, nxt[i]
+        return root
+
+    for r, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+        i = find(start)
+        while i < end:
+            first[i] = r
+            nxt[i] = i + 1
+            i = find(i + 1)
+    return first
+
+
+# Mark received ACKs that newly acknowledge ack-eliciting packets within one packet number space
+def newly_acked_ack_eliciting(sent, acks):
+    pkns = sent["pkn"].to_numpy()
+    starts = np.searchsorted(pkns, acks["ack_min"].to_numpy(), side="left")
+    ends = np.searchsorted(pkns, acks["ack_max"].to_numpy(), side="right")
+    first = first_acknowledgment(len(pkns), starts, ends)
+
+    newly = (
+        pl.DataFrame({"first": first, "ack_eliciting": sent["ack_eliciting"]})
+        .filter(pl.col("first") >= 0, pl.col("ack_eliciting"))
+        .select(pl.col("first").unique())
+    )
+    return acks.select("id").with_columns(
+        pl.int_range(pl.len(), dtype=pl.Int64).is_in(newly["first"]).alias(custom_newly_acked)
+    )
+
+
+# Add cc_max_ack_sent_time and cc_newly_acked_ack_eliciting to received packets containing ACKs
+def add_pto_info(df):
+    df = df.with_row_index("id")
+    sent = get_sent_packets(df)
+    acks = get_ack_ranges(df)
+
+    newly = [
+        newly_acked_ack_eliciting(
+            sent.filter(pl.col("space") == space), acks.filter(pl.col("space") == space)
+        )
+        for space in pkn_spaces
+    ]
+
+    info = (
+        acks.join(sent.drop("ack_eliciting"), on=["space", "pkn"], how="left")
+        .join(pl.concat(newly), on="id", how="left")
+        .select("id", custom_time_param, custom_newly_acked)
+    )
+
+    return df.join(info, on="id", how="left").drop("id")
@@ -0,0 +1,803 @@
+from datetime import datetime, timezone
+import io
+import ipaddress
+import os
+import struct
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+from cryptography.hazmat.primitives.kdf.hkdf import HKDFExpand
+from cryptography.hazmat.primitives import hmac
+import polars as pl
+import zstandard
+
+# In-process alternative to tools/tshark-extract-quic-fields.sh
+# Emits the fields of the tshark call (same names, order and formatting) for every captured frame
+fields = [
+    "ts",
+    "ip.src",
+    "ip.dst",
+    "udp.length",
+    "udp.srcport",
+    "udp.dstport",
+    "quic.version",
+    "quic.long.packet_type",
+    "quic.scid",
+    "quic.dcid",
+    "quic.frame_type",
+    "quic.ack.ack_delay",
+    "quic.ack.ack_range",
+    "quic.ack.first_ack_range",
+    "tls.quic.parameter.ack_delay_exponent",
+    "tls.handshake.type",
+    "tls.handshake.extensions_server_name",
+    "ip.ttl",
+]
+
+# QUIC is forced for traffic on port 443 (-d udp.port==443,quic)
+quic_port = 443
+
+# Initial salts per version
+initial_salts = {
+    0x00000001: bytes.fromhex("38762cf7f55934b34d179ae6a4c80cadccbb7f0a"),
+    0x6B3343CF: bytes.fromhex("0dede3def700a6db819381be6e269dcbf9bd2ed9"),
+    0xFF00001D: bytes.fromhex("afbfec289993d24c9e9786f19c6111e04390a899"),
+}
+quic_v2 = 0x6B3343CF
+
+# Long header packet types, QUIC v2 uses a different encoding of the same types
+LPT_INITIAL, LPT_0RTT, LPT_HANDSHAKE, LPT_RETRY = 0, 1, 2, 3
+v2_packet_types = {1: LPT_INITIAL, 2: LPT_0RTT, 3: LPT_HANDSHAKE, 0: LPT_RETRY}
+
+# Packet number spaces and TLS encryption levels
+SPACE_INITIAL, SPACE_HANDSHAKE, SPACE_APPLICATION = 0, 1, 2
+
+# TLS cipher suites: AEAD, key length, hash
+cipher_suites = {
+    0x1301: ("aes", 16, hashes.SHA256),
+    0x1302: ("aes", 32, hashes.SHA384),
+    0x1303: ("chacha", 32, hashes.SHA256),
+}
+
+# Keylog labels of the secrets per packet number space and sender
+keylog_labels = {
+    (SPACE_HANDSHAKE, False): [
+        "CLIENT_HANDSHAKE_TRAFFIC_SECRET",
+        "QUIC_CLIENT_HANDSHAKE_TRAFFIC_SECRET",
+    ],
+    (SPACE_HANDSHAKE, True): [
+        "SERVER_HANDSHAKE_TRAFFIC_SECRET",
+        "QUIC_SERVER_HANDSHAKE_TRAFFIC_SECRET",
+    ],
+    (SPACE_APPLICATION, False): ["CLIENT_TRAFFIC_SECRET_0", "QUIC_CLIENT_TRAFFIC_SECRET_0"],
+    (SPACE_APPLICATION, True): ["SERVER_TRAFFIC_SECRET_0", "QUIC_SERVER_TRAFFIC_SECRET_0"],
+    ("0rtt", False): ["CLIENT_EARLY_TRAFFIC_SECRET", "QUIC_CLIENT_EARLY_TRAFFIC_SECRET"],
+}
+
+# TLS extensions
+EXT_SERVER_NAME = 0x0000
+EXT_QUIC_TRANSPORT_PARAMETERS = (0x0039, 0xFFA5)
+TP_ACK_DELAY_EXPONENT = 0x0A
+
+
+# Read keylog file (NSS key log format) into dict (label, client_random) -> secret
+def read_keylog(file) -> dict:
+    keys = {}
+    if file is None or not os.path.isfile(file):
+        return keys
+
+    with open(file) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) != 3 or line.startswith("#"):
+                continue
+            label, client_random, secret = parts
+            keys[(label, bytes.fromhex(client_random))] = bytes.fromhex(secret)
+    return keys
+
+
+# Read frames of pcap or pcapng files (optionally zstd compressed)
+# Yields timestamp as (seconds, fraction, digits of fraction), link type and frame
+def read_frames(file):
+    with open(file, "rb") as f:
+        data = f.read()
+    if str(file).endswith(".zst"):
+        data = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)).read()
+
+    magic = data[:4]
+    if magic == b"\x0a\x0d\x0d\x0a":
+        yield from read_pcapng_frames(data)
+    else:
+        yield from read_pcap_frames(data)
+
+
+def read_pcap_frames(data):
+    magics = {
+        b"\xd4\xc3\xb2\xa1": ("<", 6),
+        b"\xa1\xb2\xc3\xd4": (">", 6),
+        b"\x4d\x3c\xb2\xa1": ("<", 9),
+        b"\xa1\xb2\x3c\x4d": (">", 9),
+    }
+    if len(data) < 24:
+        return
+    endian, digits = magics[data[:4]]
+    linktype = struct.unpack(f"{endian}I", data[20:24])[0] & 0x0FFFFFFF
+
+    offset = 24
+    while offset + 16 <= len(data):
+        sec, frac, caplen, _ = struct.unpack(f"{endian}IIII", data[offset : offset + 16])
+        offset += 16
+        yield (sec, frac, digits), linktype, data[offset : offset + caplen]
+        offset += caplen
+
+
+def read_pcapng_frames(data):
+    endian = "<"
+    interfaces = []
+    offset = 0
+    while offset + 12 <= len(data):
+        block_type = struct.unpack(f"{endian}I", data[offset : offset + 4])[0]
+        if block_type == 0x0A0D0D0A:
+            endian = "<" if data[offset + 8 : offset + 12] == b"\x4d\x3c\x2b\x1a" else ">"
+            interfaces = []
+        block_len = struct.unpack(f"{endian}I", data[offset + 4 : offset + 8])[0]
+        body = data[offset + 8 : offset + block_len - 4]
+        offset += block_len
+
+        if block_type == 0x00000001:
+            # Interface description, default timestamp resolution is microseconds
+            linktype = struct.unpack(f"{endian}H", body[:2])[0]
+            resolution = 6
+            options = body[8:]
+            while len(options) >= 4:
+                code, length = struct.unpack(f"{endian}HH", options[:4])
+                if code == 0:
+                    break
+                if code == 9 and not options[4] & 0x80:
+                    resolution = options[4]
+                options = options[4 + length + (-length % 4) :]
+            interfaces.append((linktype, resolution))
+        elif block_type == 0x00000006:
+            interface, ts_high, ts_low, caplen = struct.unpack(f"{endian}IIII", body[:16])
+            linktype, resolution = interfaces[interface]
+            ts = (ts_high << 32) | ts_low
+            ts = (ts // 10**resolution, ts % 10**resolution, resolution)
+            yield ts, linktype, body[20 : 20 + caplen]
+        elif block_type == 0x00000003:
+            linktype, resolution = interfaces[0]
+            yield (0, 0, resolution), linktype, body[4:]
+
+
+# Strip link layer, returns ethertype-like protocol and network layer payload
+def strip_link_layer(linktype, frame):
+    if linktype == 1:  # Ethernet
+        proto = struct.unpack("!H", frame[12:14])[0]
+        offset = 14
+        while proto in (0x8100, 0x88A8):
+            proto = struct.unpack("!H", frame[offset + 2 : offset + 4])[0]
+            offset += 4
+        return proto, frame[offset:]
+    if linktype == 9:  # PPP
+        if frame[:2] == b"\xff\x03":
+            frame = frame[2:]
+        proto = struct.unpack("!H", frame[:2])[0]
+        return {0x0021: 0x0800, 0x0057: 0x86DD}.get(proto, proto), frame[2:]
+    if linktype in (101, 228, 229, 12):  # Raw IP
+        return (0x0800 if frame[0] >> 4 == 4 else 0x86DD), frame
+    if linktype == 113:  # Linux cooked capture
+        return struct.unpack("!H", frame[14:16])[0], frame[16:]
+    if linktype == 276:  # Linux cooked capture v2
+        return struct.unpack("!H", frame[:2])[0], frame[20:]
+    if linktype in (0, 108):  # BSD loopback
+        family = struct.unpack("<I", frame[:4])[0]
+        if family > 0xFFFF:
+            family = struct.unpack(">I", frame[:4])[0]
+        return (0x0800 if family == 2 else 0x86DD), frame[4:]
+    return None, frame
+
+
+# Variable-length integer, returns value and length
+def read_varint(data, offset):
+    first = data[offset]
+    length = 1 << (first >> 6)
+    if offset + length > len(data):
+        raise IndexError("Truncated varint")
+    value = first & 0x3F
+    for b in data[offset + 1 : offset + length]:
+        value = (value << 8) | b
+    return value, length
+
+
+def hkdf_extract(salt, ikm, algorithm=hashes.SHA256):
+    h = hmac.HMAC(salt, algorithm())
+    h.update(ikm)
+    return h.finalize()
+
+
+def hkdf_expand_label(secret, label, length, algorithm=hashes.SHA256):
+    full_label = b"tls13 " + label.encode()
+    info = struct.pack("!HB", length, len(full_label)) + full_label + b"\x00"
+    return HKDFExpand(algorithm(), length, info).derive(secret)
+
+
+# Packet protection keys derived from a traffic secret
+class PacketProtection:
+    def __init__(self, secret, cipher_suite, version):
+        self.secret = secret
+        self.cipher_suite = cipher_suite
+        self.version = version
+        aead, key_len, algorithm = cipher_suites[cipher_suite]
+        prefix = "quicv2 " if version == quic_v2 else "quic "
+        self.key = hkdf_expand_label(secret, prefix + "key", key_len, algorithm)
+        self.iv = hkdf_expand_label(secret, prefix + "iv", 12, algorithm)
+        hp = hkdf_expand_label(secret, prefix + "hp", key_len, algorithm)
+
+        if aead == "aes":
+            self.aead = AESGCM(self.key)
+            self.hp = Cipher(algorithms.AES(hp), modes.ECB()).encryptor()
+        else:
+            self.aead = ChaCha20Poly1305(self.key)
+            self.hp = hp
+        self.is_chacha = aead == "chacha"
+
+    def mask(self, sample):
+        if self.is_chacha:
+            cipher = Cipher(algorithms.ChaCha20(self.hp, sample), mode=None).encryptor()
+            return cipher.update(bytes(5))
+        return self.hp.update(sample)[:5]
+
+    # Keys after a key update, header protection keys are not updated
+    def next_phase(self):
+        prefix = "quicv2 " if self.version == quic_v2 else "quic "
+        _, _, algorithm = cipher_suites[self.cipher_suite]
+        secret = hkdf_expand_label(self.secret, prefix + "ku", algorithm.digest_size, algorithm)
+        updated = PacketProtection(secret, self.cipher_suite, self.version)
+        updated.hp, updated.is_chacha = self.hp, self.is_chacha
+        return updated
+
+    def decrypt(self, pn, header, payload):
+        nonce = bytes(a ^ b for a, b in zip(self.iv, pn.to_bytes(12, "big")))
+        return self.aead.decrypt(nonce, payload, header)
+
+
+def initial_protection(dcid, version, from_server):
+    salt = initial_salts.get(version)
+    if salt is None:
+        return None
+    initial_secret = hkdf_extract(salt, dcid)
+    label = "server in" if from_server else "client in"
+    secret = hkdf_expand_label(initial_secret, label, 32)
+    return PacketProtection(secret, 0x1301, version)
+
+
+# Reassembly of CRYPTO frames of one encryption level and direction
+class CryptoStream:
+    def __init__(self):
+        self.fragments = {}
+        self.data = b""
+        self.offset = 0
+        self.parsed = 0
+
+    # Add data of a CRYPTO frame and return completed handshake messages
+    def add(self, offset, data):
+        end = offset + len(data)
+        if end <= self.offset:
+            return []
+        if offset < self.offset:
+            data = data[self.offset - offset :]
+            offset = self.offset
+        self.fragments[offset] = max(self.fragments.get(offset, b""), data, key=len)
+
+        # Append contiguous fragments
+        while True:
+            contiguous = [o for o in self.fragments if o <= self.offset]
+            if not contiguous:
+                break
+            for o in contiguous:
+                fragment = self.fragments.pop(o)
+                if o + len(fragment) > self.offset:
+                    self.data += fragment[self.offset - o :]
+                    self.offset = o + len(fragment)
+
+        messages = []
+        while self.parsed + 4 <= len(self.data):
+            length = int.from_bytes(self.data[self.parsed + 1 : self.parsed + 4], "big")
+            if self.parsed + 4 + length > len(self.data):
+                break
+            messages.append(self.data[self.parsed : self.parsed + 4 + length])
+            self.parsed += 4 + length
+        return messages
+
+
+# State of one QUIC connection
+class Connection:
+    def __init__(self, client, server, version, dcid):
+        self.client = client
+        self.server = server
+        self.version = version
+        self.initial_dcid = dcid
+        self.client_cids = set()
+        self.server_cids = {dcid} if dcid else set()
+        self.client_random = None
+        self.cipher_suite = None
+        self.protection = {}
+        self.largest_pn = {}
+        self.crypto = {}
+
+    def get_protection(self, space, from_server, keys, key_phase=0):
+        key = (space, from_server, key_phase)
+        if key in self.protection:
+            return self.protection[key]
+
+        protection = None
+        if space == SPACE_INITIAL:
+            protection = initial_protection(self.initial_dcid, self.version, from_server)
+        elif space == SPACE_APPLICATION and key_phase > 0:
+            previous = self.get_protection(space, from_server, keys, key_phase - 1)
+            protection = previous.next_phase() if previous else None
+        elif self.client_random is not None:
+            cipher_suite = self.cipher_suite if self.cipher_suite is not None else 0x1301
+            for label in keylog_labels[(space, from_server)]:
+                secret = keys.get((label, self.client_random))
+                if secret is not None and (space == "0rtt" or self.cipher_suite is not None):
+                    protection = PacketProtection(secret, cipher_suite, self.version)
+                    break
+        if protection is not None:
+            self.protection[key] = protection
+        return protection
+
+    def get_crypto(self, space, from_server) -> CryptoStream:
+        return self.crypto.setdefault((space, from_server), CryptoStream())
+
+
+# Values of all fields of one frame, multiple occurrences are joined by ","
+class Row:
+    def __init__(self, ts):
+        self.values = {field: [] for field in fields}
+        self.values["ts"].append(ts)
+
+    def add(self, field, value):
+        self.values[field].append(value)
+
+    def to_list(self):
+        return [",".join(str(v) for v in self.values[field]) for field in fields]
+
+
+# Extract fields of all frames of a pcap
+class QuicExtractor:
+    def __init__(self, keylog=None):
+        self.keys = read_keylog(keylog)
+        self.connections = []
+        self.by_cid = {}
+        self.by_tuple = {}
+
+    def process(self, file):
+        return list(self.iter_rows(file))
+
+    # Rows one by one as the frames are dissected
+    def iter_rows(self, file):
+        for ts, linktype, frame in read_frames(file):
+            row = Row(format_ts(ts))
+            proto, payload = strip_link_layer(linktype, frame)
+            try:
+                self.dissect_network(row, proto, payload)
+            except (IndexError, struct.error, ValueError):
+                pass
+            yield row.to_list()
+
+    def dissect_network(self, row, proto, payload, quoted=False):
+        if proto == 0x0800:
+            ihl = (payload[0] & 0x0F) * 4
+            total_length = struct.unpack("!H", payload[2:4])[0]
+            ip_proto = payload[9]
+            src = str(ipaddress.IPv4Address(payload[12:16]))
+            dst = str(ipaddress.IPv4Address(payload[16:20]))
+            row.add("ip.src", src)
+            row.add("ip.dst", dst)
+            row.add("ip.ttl", payload[8])
+            fragment = struct.unpack("!H", payload[6:8])[0] & 0x3FFF
+            if fragment:
+                return
+            # Quoted packets are truncated, their total length exceeds the captured data
+            transport = payload[ihl:total_length] if not quoted else payload[ihl:]
+        elif proto == 0x86DD:
+            ip_proto = payload[6]
+            src = str(ipaddress.IPv6Address(payload[8:24]))
+            dst = str(ipaddress.IPv6Address(payload[24:40]))
+            payload_length = struct.unpack("!H", payload[4:6])[0]
+            transport = payload[40 : 40 + payload_length] if not quoted else payload[40:]
+        else:
+            return
+
+        if ip_proto == 17:
+            self.dissect_udp(row, src, dst, transport)
+        elif not quoted and ip_proto == 1 and transport[0] in (3, 4, 5, 11, 12):
+            # ICMP errors quote the IP header and the beginning of the offending packet
+            self.dissect_network(row, 0x0800, transport[8:], quoted=True)
+        elif not quoted and ip_proto == 58 and transport[0] in (1, 2, 3, 4):
+            self.dissect_network(row, 0x86DD, transport[8:], quoted=True)
+
+    def dissect_udp(self, row, src, dst, segment):
+        sport, dport, length = struct.unpack("!HHH", segment[:6])
+        row.add("udp.length", length)
+        row.add("udp.srcport", sport)
+        row.add("udp.dstport", dport)
+
+        payload = segment[8:length]
+        # Truncated packets, e.g., quoted by ICMP, are not dissected
+        if len(payload) < length - 8:
+            return
+        if quic_port in (sport, dport):
+            self.dissect_datagram(row, (src, sport), (dst, dport), payload)
+
+    def find_connection(self, src, dst, dcid):
+        conn = self.by_cid.get(dcid) if dcid else None
+        if conn is None and not dcid:
+            conn = self.by_tuple.get((src, dst)) or self.by_tuple.get((dst, src))
+        if conn is None:
+            return None, False
+        return conn, src == conn.server
+
+    def register_cid(self, conn, cid, from_server):
+        if not cid:
+            return
+        (conn.server_cids if from_server else conn.client_cids).add(cid)
+        self.by_cid.setdefault(cid, conn)
+
+    # Short header packets carry no DCID length, try lengths of known CIDs
+    def find_short_header_connection(self, src, dst, data):
+        for length in sorted({len(cid) for cid in self.by_cid}, reverse=True):
+            conn = self.by_cid.get(bytes(data[1 : 1 + length]))
+            if conn is not None:
+                return conn, bytes(data[1 : 1 + length]), src == conn.server
+        conn, from_server = self.find_connection(src, dst, b"")
+        return conn, b"", from_server
+
+    def dissect_datagram(self, row, src, dst, data):
+        offset = 0
+        while offset < len(data):
+            first = data[offset]
+            if offset > 0 and not first & 0x40:
+                # Remaining bytes are padding
+                break
+            if first & 0x80:
+                offset = self.dissect_long_header(row, src, dst, data, offset)
+            else:
+                self.dissect_short_header(row, src, dst, data, offset)
+                break
+            if offset is None:
+                break
+
+    def dissect_long_header(self, row, src, dst, data, offset):
+        first = data[offset]
+        version = struct.unpack("!I", data[offset + 1 : offset + 5])[0]
+        pos = offset + 5
+        dcid_len = data[pos]
+        dcid = bytes(data[pos + 1 : pos + 1 + dcid_len])
+        pos += 1 + dcid_len
+        scid_len = data[pos]
+        scid = bytes(data[pos + 1 : pos + 1 + scid_len])
+        pos += 1 + scid_len
+
+        row.add("quic.version", f"0x{version:08x}")
+        if version == 0:
+            # Version negotiation
+            self.add_cids(row, scid, dcid)
+            return None
+
+        long_type = (first & 0x30) >> 4
+        if version == quic_v2:
+            long_type = v2_packet_types[long_type]
+        row.add("quic.long.packet_type", long_type)
+        self.add_cids(row, scid, dcid)
+
+        conn, from_server = self.find_connection(src, dst, dcid)
+        if conn is None and long_type == LPT_INITIAL:
+            conn = Connection(src, dst, version, dcid)
+            self.connections.append(conn)
+            self.by_cid.setdefault(dcid, conn)
+            self.by_tuple[(src, dst)] = conn
+            from_server = False
+        if conn is not None:
+            self.register_cid(conn, scid, from_server)
+
+        if long_type == LPT_RETRY:
+            if conn is not None and from_server:
+                # Client Initials after the retry use keys derived from the new CID
+                conn.initial_dcid = scid
+                conn.protection.pop((SPACE_INITIAL, False, 0), None)
+                conn.protection.pop((SPACE_INITIAL, True, 0), None)
+            return None
+
+        if long_type == LPT_INITIAL:
+            token_len, n = read_varint(data, pos)
+            pos += n + token_len
+        length, n = read_varint(data, pos)
+        pos += n
+        end = pos + length
+        if end > len(data):
+            return None
+
+        if conn is not None:
+            space = {
+                LPT_INITIAL: SPACE_INITIAL,
+                LPT_HANDSHAKE: SPACE_HANDSHAKE,
+                LPT_0RTT: SPACE_APPLICATION,
+            }[long_type]
+            key_space = "0rtt" if long_type == LPT_0RTT else space
+            protection = conn.get_protection(key_space, from_server, self.keys)
+            self.decrypt_packet(
+                row, conn, from_server, space, protection, data, offset, pos, end, 0x0F
+            )
+        return end
+
+    def dissect_short_header(self, row, src, dst, data, offset):
+        conn, dcid, from_server = self.find_short_header_connection(src, dst, data[offset:])
+        if conn is None:
+            return
+        if dcid:
+            row.add("quic.dcid", dcid.hex())
+
+        pos = offset + 1 + len(dcid)
+        protection = conn.get_protection(SPACE_APPLICATION, from_server, self.keys)
+        self.decrypt_packet(
+            row,
+            conn,
+            from_server,
+            SPACE_APPLICATION,
+            protection,
+            data,
+            offset,
+            pos,
+            len(data),
+            0x1F,
+        )
+
+    def add_cids(self, row, scid, dcid):
+        if scid:
+            row.add("quic.scid", scid.hex())
+        if dcid:
+            row.add("quic.dcid", dcid.hex())
+
+    # Remove header protection, decrypt and dissect frames
+    def decrypt_packet(
+        self, row, conn, from_server, space, protection, data, offset, pn_offset, end, bits
+    ):
+        if protection is None or pn_offset + 20 > end:
+            return
+
+        sample = bytes(data[pn_offset + 4 : pn_offset + 20])
+        mask = protection.mask(sample)
+        first = data[offset] ^ (mask[0] & bits)
+        pn_len = (first & 0x03) + 1
+        pn_bytes = bytes(b ^ m for b, m in zip(data[pn_offset : pn_offset + pn_len], mask[1:]))
+        truncated = int.from_bytes(pn_bytes, "big")
+
+        largest = conn.largest_pn.get((space, from_server), -1)
+        pn = decode_packet_number(largest, truncated, pn_len * 8)
+
+        header = bytes([first]) + bytes(data[offset + 1 : pn_offset]) + pn_bytes
+        payload = bytes(data[pn_offset + pn_len : end])
+
+        key_phase = 0
+        if space == SPACE_APPLICATION and bits == 0x1F:
+            key_phase = (first & 0x04) >> 2
+            phase = conn.largest_pn.get(("phase", from_server), 0)
+            # Key phase bit toggles on every key update
+            if key_phase != phase % 2:
+                phase += 1
+            protection = conn.get_protection(space, from_server, self.keys, phase)
+            key_phase = phase
+        try:
+            plaintext = protection.decrypt(pn, header, payload)
+        except Exception:
+            return
+
+        conn.largest_pn[(space, from_server)] = max(largest, pn)
+        if space == SPACE_APPLICATION and bits == 0x1F:
+            conn.largest_pn[("phase", from_server)] = key_phase
+        self.dissect_frames(row, conn, from_server, space, plaintext)
+
+    def dissect_frames(self, row, conn, from_server, space, data):
+        pos = 0
+        while pos < len(data):
+            frame_type, n = read_varint(data, pos)
+            pos += n
+            if frame_type == 0x00:
+                while pos < len(data) and data[pos] == 0:
+                    pos += 1
+                row.add("quic.frame_type", frame_type)
+                continue
+            row.add("quic.frame_type", frame_type)
+
+            if frame_type == 0x01 or frame_type in (0x1E, 0x1F):
+                continue
+            if frame_type in (0x02, 0x03):
+                _, n = read_varint(data, pos)
+                pos += n
+                ack_delay, n = read_varint(data, pos)
+                pos += n
+                range_count, n = read_varint(data, pos)
+                pos += n
+                first_range, n = read_varint(data, pos)
+                pos += n
+                row.add("quic.ack.ack_delay", ack_delay)
+                row.add("quic.ack.first_ack_range", first_range)
+                for _ in range(range_count):
+                    _, n = read_varint(data, pos)
+                    pos += n
+                    ack_range, n = read_varint(data, pos)
+                    pos += n
+                    row.add("quic.ack.ack_range", ack_range)
+                if frame_type == 0x03:
+                    for _ in range(3):
+                        _, n = read_varint(data, pos)
+                        pos += n
+            elif frame_type == 0x06:
+                crypto_offset, n = read_varint(data, pos)
+                pos += n
+                length, n = read_varint(data, pos)
+                pos += n
+                self.dissect_crypto(
+                    row, conn, from_server, space, crypto_offset, data[pos : pos + length]
+                )
+                pos += length
+            elif 0x08 <= frame_type <= 0x0F:
+                _, n = read_varint(data, pos)
+                pos += n
+                if frame_type & 0x04:
+                    _, n = read_varint(data, pos)
+                    pos += n
+                if frame_type & 0x02:
+                    length, n = read_varint(data, pos)
+                    pos += n + length
+                else:
+                    pos = len(data)
+            elif frame_type == 0x18:
+                _, n = read_varint(data, pos)
+                pos += n
+                _, n = read_varint(data, pos)
+                pos += n
+                cid_len = data[pos]
+                self.register_cid(conn, bytes(data[pos + 1 : pos + 1 + cid_len]), from_server)
+                pos += 1 + cid_len + 16
+            elif frame_type in (0x30, 0x31):
+                if frame_type == 0x31:
+                    length, n = read_varint(data, pos)
+                    pos += n + length
+                else:
+                    pos = len(data)
+            else:
+                pos = skip_frame(frame_type, data, pos)
+
+    def dissect_crypto(self, row, conn, from_server, space, offset, data):
+        for message in conn.get_crypto(space, from_server).add(offset, data):
+            msg_type = message[0]
+            row.add("tls.handshake.type", msg_type)
+            body = message[4:]
+            if msg_type == 1:
+                conn.client_random = bytes(body[2:34])
+                self.dissect_client_hello(row, body)
+            elif msg_type == 2:
+                session_id_len = body[34]
+                pos = 35 + session_id_len
+                cipher_suite = struct.unpack("!H", body[pos : pos + 2])[0]
+                if cipher_suite in cipher_suites:
+                    conn.cipher_suite = cipher_suite
+            elif msg_type == 8:
+                self.dissect_extension_list(row, body, 0)
+
+    def dissect_client_hello(self, row, body):
+        pos = 34
+        session_id_len = body[pos]
+        pos += 1 + session_id_len
+        cipher_len = struct.unpack("!H", body[pos : pos + 2])[0]
+        pos += 2 + cipher_len
+        compression_len = body[pos]
+        pos += 1 + compression_len
+        self.dissect_extension_list(row, body, pos)
+
+    def dissect_extension_list(self, row, body, pos):
+        total = struct.unpack("!H", body[pos : pos + 2])[0]
+        pos += 2
+        end = pos + total
+        while pos + 4 <= end:
+            ext_type, ext_len = struct.unpack("!HH", body[pos : pos + 4])
+            ext = body[pos + 4 : pos + 4 + ext_len]
+            pos += 4 + ext_len
+            if ext_type == EXT_SERVER_NAME:
+                list_pos = 2
+                while list_pos + 3 <= len(ext):
+                    name_type = ext[list_pos]
+                    name_len = struct.unpack("!H", ext[list_pos + 1 : list_pos + 3])[0]
+                    if name_type == 0:
+                        name = ext[list_pos + 3 : list_pos + 3 + name_len].decode()
+                        row.add("tls.handshake.extensions_server_name", name)
+                    list_pos += 3 + name_len
+            elif ext_type in EXT_QUIC_TRANSPORT_PARAMETERS:
+                param_pos = 0
+                while param_pos < len(ext):
+                    param_id, n = read_varint(ext, param_pos)
+                    param_pos += n
+                    param_len, n = read_varint(ext, param_pos)
+                    param_pos += n
+                    if param_id == TP_ACK_DELAY_EXPONENT:
+                        value, _ = read_varint(ext, param_pos)
+                        row.add("tls.quic.parameter.ack_delay_exponent", value)
+                    param_pos += param_len
+
+
+# Skip fields of frames without extracted information
+def skip_frame(frame_type, data, pos):
+    # Number of varints per frame type
+    varints = {
+        0x04: 3,
+        0x05: 2,
+        0x10: 1,
+        0x11: 2,
+        0x12: 1,
+        0x13: 1,
+        0x14: 1,
+        0x15: 2,
+        0x16: 1,
+        0x17: 1,
+        0x19: 1,
+        0xAF: 3,
+    }
+    if frame_type == 0x07:
+        length, n = read_varint(data, pos)
+        return pos + n + length
+    if frame_type in (0x1A, 0x1B):
+        return pos + 8
+    if frame_type in (0x1C, 0x1D):
+        _, n = read_varint(data, pos)
+        pos += n
+        if frame_type == 0x1C:
+            _, n = read_varint(data, pos)
+            pos += n
+        length, n = read_varint(data, pos)
+        return pos + n + length
+    if frame_type not in varints:
+        # Unknown frame, remaining payload can not be parsed
+        return len(data)
+    for _ in range(varints[frame_type]):
+        _, n = read_varint(data, pos)
+        pos += n
+    return pos
+
+
+def decode_packet_number(largest, truncated, pn_nbits):
+    expected = largest + 1
+    win = 1 << pn_nbits
+    hwin = win // 2
+    mask = win - 1
+    candidate = (expected & ~mask) | truncated
+    if candidate <= expected - hwin and candidate < (1 << 62) - win:
+        return candidate + win
+    if candidate > expected + hwin and candidate >= win:
+        return candidate - win
+    return candidate
+
+
+# Format as tshark -t ud (UTC date and time of day)
+def format_ts(ts):
+    sec, frac, digits = ts
+    date = datetime.fromtimestamp(sec, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    return f"{date}.{frac:0{digits}d}"
+
+
+# Extract fields of a pcap as DataFrame, all values as strings like the tshark output
+def extract_quic_fields(pcap, keylog=None) -> pl.DataFrame:
+    rows = QuicExtractor(keylog).process(pcap)
+    return pl.DataFrame(rows, schema=fields, orient="row")
+
+
+# Write fields in the format of tools/tshark-extract-quic-fields.sh
+def write_quic_fields(pcap, out_file, keylog=None):
+    rows = QuicExtractor(keylog).process(pcap)
+    # Interrupted extractions must not leave partial files, these are not reprocessed
+    with open(f"{out_file}.tmp", "w") as f:
+        for row in rows:
+            f.write("|".join(row) + "\n")
+    os.replace(f"{out_file}.tmp", out_file)
@@ -0,0 +1,178 @@
+from pathlib import Path
+import hashlib
+import os
+
+import polars as pl
+
+from instant_ack.data import connections
+from instant_ack.data import manifest
+from instant_ack.data import storage
+
+# qlog datasets are stored as star schema: a runs dimension table with one row per qlog file
+# (client, server, folder metadata, ...) and an event table referencing its run by run_id
+# meta_delay partitions both tables, it is contained in both
+run_key = "run_id"
+partition_by = "meta_delay"
+run_cols = ["file", "folder", "client", "server", "scenario", "rtt", "server_group"]
+
+
+# Stable integer key of a run derived from the path of its qlog file, 63 bit fit into Int64
+def get_run_id(file) -> int:
+    digest = hashlib.blake2b(str(file).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little") >> 1
+
+
+# Runs table of a qlog dataset, e.g. qlog/runs/qlog.aioquic.pq.zst
+def get_runs_file(dataset: Path) -> Path:
+    return Path(dataset).parent / "runs" / Path(dataset).name
+
+
+# Add run_id to events that still carry the file column
+def add_run_id(df: pl.LazyFrame, files: list[str]) -> pl.LazyFrame:
+    ids = [get_run_id(file) for file in files]
+    return df.with_columns(
+        pl.col("file")
+        .cast(pl.String)
+        .replace_strict(files, ids, return_dtype=pl.Int64)
+        .alias(run_key)
+    )
+
+
+# Columns moved into the runs table, only those constant within every run
+def get_run_columns(df: pl.LazyFrame) -> list[str]:
+    names = df.collect_schema().names()
+    candidates = [col for col in names if col in run_cols or col.startswith("meta_")]
+    candidates = [col for col in candidates if col not in ["file", partition_by]]
+    if len(candidates) == 0:
+        return ["file"]
+
+    n_unique = (
+        df.group_by("file").agg(pl.col(candidates).n_unique()).select(pl.col(candidates).max())
+    )
+    n_unique = n_unique.collect().row(0, named=True)
+    return ["file"] + [col for col in candidates if n_unique[col] <= 1]
+
+
+# Split events with metadata into the event and runs tables
+def split_runs(df: pl.LazyFrame, files: list[str]) -> tuple[pl.LazyFrame, pl.LazyFrame]:
+    df = add_run_id(df.lazy(), files)
+    cols = get_run_columns(df)
+
+    # One row per run, small enough to collect (unique can not be sunk by streaming)
+    runs = df.select(run_key, partition_by, *cols).unique(run_key, maintain_order=True)
+    runs = runs.collect().lazy()
+    events = df.drop(cols)
+    return events, runs
+
+
+# Append events with metadata to a qlog dataset and record their files in its manifest
+# Runs processed again replace the previous events, runs and connections
+def sink_runs_and_events(new_df: pl.LazyFrame, dest: Path):
+    new_df = new_df.lazy()
+    runs_file = get_runs_file(dest)
+    connections_file = connections.get_connections_file(dest)
+    files = new_df.select(pl.col("file").unique()).collect()["file"].cast(pl.String).to_list()
+    processed = manifest.load_manifest(dest, index_file=runs_file)
+
+    storage.migrate_dataset(dest, partition_by)
+    migrate_to_runs(dest)
+    migrate_to_connections(dest)
+
+    stale = [file for file in files if file in processed]
+    stale_ids = [get_run_id(f) for f in stale]
+    storage.remove_files_from_dataset(dest, stale_ids, col=run_key)
+    storage.remove_files_from_dataset(runs_file, stale)
+    storage.remove_files_from_dataset(connections_file, stale_ids, col=run_key)
+
+    events, runs = split_runs(new_df, files)
+    storage.append_to_dataset(events, dest, partition_by)
+    storage.append_to_dataset(runs, runs_file, partition_by)
+    # One row per run, collected as runs (group_by can not be sunk by streaming)
+    summary = connections.summarize(events, [run_key, partition_by]).collect()
+    storage.append_to_dataset(summary.lazy(), connections_file, partition_by)
+    manifest.save_manifest(dest, files)
+
+
+# Datasets written before the runs table carry the metadata in every event, split once
+def migrate_to_runs(dest: Path):
+    if not storage.dataset_exists(dest):
+        return
+    if run_key in storage.scan_dataset(dest).collect_schema():
+        return
+
+    legacy = Path(f"{dest}.legacy")
+    os.rename(dest, legacy)
+    df = storage.scan_dataset(legacy)
+    files = df.select(pl.col("file").unique()).collect()["file"].cast(pl.String).to_list()
+
+    events, runs = split_runs(df, files)
+    storage.remove_dataset(get_runs_file(dest))
+    storage.append_to_dataset(events, dest, partition_by)
+    storage.append_to_dataset(runs, get_runs_file(dest), partition_by)
+    storage.remove_dataset(legacy)
+
+
+# Datasets written before the connections table are summarized once
+def migrate_to_connections(dest: Path):
+    connections_file = connections.get_connections_file(dest)
+    if not storage.dataset_exists(dest) or storage.dataset_exists(connections_file):
+        return
+
+    summary = connections.summarize(storage.scan_dataset(dest), [run_key, partition_by])
+    storage.append_to_dataset(summary.collect().lazy(), connections_file, partition_by)
+
+
+def scan_runs(dest: Path, **kwargs) -> pl.LazyFrame:
+    return storage.scan_dataset(get_runs_file(dest), **kwargs)
+
+
+# Join runs to events on demand, filters on run columns are applied to the small runs table
+def join_runs(events: pl.LazyFrame, runs: pl.LazyFrame) -> pl.LazyFrame:
+    df = events.join(runs.drop(partition_by, strict=False), on=run_key, how="inner")
+    return df.select(sorted(df.collect_schema().names()))
+
+
+# Scan a qlog dataset, optionally with the metadata of its runs
+# Datasets without runs table still carry the metadata in their events
+# Columns and filters are split by table, filtered runs drop their events in the join
+def scan_events(dest: Path, with_runs=True, columns=None, filters=None, **kwargs) -> pl.LazyFrame:
+    filters = filters or {}
+    if not storage.dataset_exists(get_runs_file(dest)):
+        return storage.scan_dataset(dest, columns, filters, **kwargs)
+
+    # The partition column is contained in both tables
+    in_runs = set(scan_runs(dest).collect_schema().names()) - {partition_by}
+    run_filters = {col: v for col, v in filters.items() if col in in_runs or col == partition_by}
+    event_filters = {col: v for col, v in filters.items() if col not in in_runs}
+    run_columns, event_columns = None, None
+    if columns is not None:
+        # run_key is the join key of both tables, it is selected once per table
+        run_columns = [run_key] + [col for col in columns if col in in_runs - {run_key}]
+        event_columns = [run_key] + [col for col in columns if col not in in_runs]
+
+    events = storage.scan_dataset(dest, event_columns, event_filters, **kwargs)
+    runs = scan_runs(dest, columns=run_columns, filters=run_filters)
+    if with_runs:
+        return join_runs(events, runs)
+    if len(run_filters) > 0:
+        return events.join(runs.select(run_key), on=run_key, how="semi")
+    return events
+
+
+# Scan the connections table of a qlog dataset, optionally with the metadata of its runs
+# Datasets not appended to since the table was introduced are summarized on the fly
+def scan_connections(dest: Path, with_runs=True, **kwargs) -> pl.LazyFrame:
+    connections_file = connections.get_connections_file(dest)
+    if storage.dataset_exists(connections_file):
+        df = storage.scan_dataset(connections_file, **kwargs)
+    else:
+        df = connections.summarize(storage.scan_dataset(dest, **kwargs), [run_key, partition_by])
+    if not with_runs:
+        return df
+    return join_runs(df, scan_runs(dest))
+
+
+# Remove the tables derived from the events
+def remove_runs(dest: Path):
+    storage.remove_dataset(get_runs_file(dest))
+    storage.remove_dataset(connections.get_connections_file(dest))
@@ -0,0 +1,43 @@
+import polars as pl
+import polars.selectors as cs
+
+# Dictionary encoded types of the interim qlog datasets
+# Strings repeated in every row of a file or folder are stored once per dictionary
+# Closed sets are Enums, their categories (physical codes) are the same in every dataset
+# Open sets are Categoricals, sorted lexically like the strings they replace
+# Values written by the qlog implementations (clients, packet types of different qlog drafts) are
+# open sets, new clients or spellings must not abort the ingest
+# Categoricals of different files and datasets are combined, which requires the global string cache
+pl.enable_string_cache()
+
+# Assigned at ingest, see folder_to_df
+server_groups = ["IACK", "WFC"]
+
+categorical = pl.Categorical("lexical")
+
+qlog_schema = {
+    "server_group": pl.Enum(server_groups),
+    "client": categorical,
+    "data_header_packet_type": categorical,
+    "file": categorical,
+    "folder": categorical,
+    "server": categorical,
+    "scenario": categorical,
+    "name": categorical,
+}
+
+
+# Cast qlog columns to their dictionary encoded types, including all string meta_* columns
+# Parquet does not keep Enums and the ordering of Categoricals, apply again after reading
+def apply_qlog_schema(df: pl.DataFrame | pl.LazyFrame) -> pl.DataFrame | pl.LazyFrame:
+    schema = df.collect_schema()
+    return df.with_columns(
+        *[pl.col(col).cast(dtype) for col, dtype in qlog_schema.items() if col in schema],
+        (cs.starts_with("meta_") & (cs.string() | cs.categorical())).cast(categorical),
+    )
+
+
+# Cast dictionary encoded columns back to strings
+# seaborn shows all categories of Enums and orders by categories instead of appearance
+def decode(df: pl.DataFrame | pl.LazyFrame) -> pl.DataFrame | pl.LazyFrame:
+    return df.with_columns((cs.categorical() | cs.by_dtype(pl.Enum)).cast(pl.String))
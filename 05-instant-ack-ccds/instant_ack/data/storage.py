@@ -0,0 +1,178 @@
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import quote, unquote
+import os
+import shutil
+
+import polars as pl
+import polars.selectors as cs
+
+# Interim datasets are directories of hive-partitioned parquet fragments, e.g.
+# qlog/qlog.aioquic.pq.zst/meta_delay=10.0/2024-08-01T00-00-00-000000.pq
+# New data is appended as new fragments instead of rewriting the whole dataset
+hive_null = "__HIVE_DEFAULT_PARTITION__"
+
+
+def get_fragments(dataset: Path) -> list[Path]:
+    return sorted(Path(dataset).glob("*=*/*.pq"))
+
+
+# Datasets created before partitioning are single parquet files
+def dataset_exists(dataset: Path) -> bool:
+    return os.path.isfile(dataset) or len(get_fragments(dataset)) > 0
+
+
+# Filter of load_data, a value (equal), a list of values (any of) or a (start, end) range
+# None as start or end of a range leaves it open
+# Strings are compared as strings, Categoricals pushed into parquet scans do not match once
+# the global string cache holds their categories
+def get_filter(col: str, value) -> pl.Expr:
+    values = list(value) if isinstance(value, (tuple, list, set)) else [value]
+    expr = pl.col(col)
+    if len(values) > 0 and all(isinstance(v, str) or v is None for v in values):
+        expr = expr.cast(pl.String)
+
+    if isinstance(value, tuple):
+        start, end = value
+        selected = pl.lit(True)
+        if start is not None:
+            selected = selected & (expr >= start)
+        if end is not None:
+            selected = selected & (expr <= end)
+        return selected
+    if isinstance(value, (list, set)):
+        return expr.is_in(values)
+    return expr == value
+
+
+# A value, e.g., of a partition or in the name of a dataset, matches the filter of its column
+def matches_filter(col: str, value, filters: dict) -> bool:
+    if col not in filters:
+        return True
+    df = pl.DataFrame({col: [value]})
+    return bool(df.select(get_filter(col, filters[col]).fill_null(False)).item())
+
+
+# Partition folder, e.g. meta_delay=10.0, matches the filter of its column
+def partition_matches(folder: str, filters: dict) -> bool:
+    col, value = folder.split("=", 1)
+    value = None if value == hive_null else unquote(value)
+    # Partition values are inferred as numbers where possible, as by hive_partitioning
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        pass
+    return matches_filter(col, value, filters)
+
+
+# Scan all fragments, columns of fragments differ (diagonal concat)
+# Types may differ as well, e.g., String and Categorical, these are relaxed to their supertype
+# Consecutive fragments with the same (projected) schema are scanned at once without reconciliation
+# Filters on the partition column skip fragments of other partitions, other filters are pushed
+# into the scans, parquet statistics skip row groups
+def scan_dataset(dataset: Path, columns=None, filters=None, **kwargs) -> pl.LazyFrame:
+    filters = filters or {}
+    if os.path.isfile(dataset):
+        return select_and_filter(pl.scan_parquet(dataset, **kwargs), columns, filters)
+
+    groups = []
+    for fragment in get_fragments(dataset):
+        if not partition_matches(fragment.parent.name, filters):
+            continue
+        schema = pl.read_parquet_schema(fragment)
+        if columns is not None:
+            schema = {col: dtype for col, dtype in schema.items() if col in columns}
+        if len(groups) > 0 and groups[-1][0] == schema:
+            groups[-1][1].append(fragment)
+        else:
+            groups.append((schema, [fragment]))
+
+    dfs = [
+        select_and_filter(
+            pl.scan_parquet(fragments, hive_partitioning=True, **kwargs), columns, filters
+        )
+        for _, fragments in groups
+    ]
+    # All partitions filtered, scan one fragment for the schema
+    if len(dfs) == 0:
+        df = pl.scan_parquet(get_fragments(dataset)[0], hive_partitioning=True, **kwargs)
+        return select_and_filter(df, columns, {}).filter(pl.lit(False))
+    if len(dfs) == 1:
+        return dfs[0]
+    return pl.concat(dfs, how="diagonal_relaxed")
+
+
+# Columns missing in a scan are null, filters on them do not match any row
+def select_and_filter(df: pl.LazyFrame, columns, filters: dict) -> pl.LazyFrame:
+    names = df.collect_schema().names()
+    exprs = [
+        get_filter(col, value) if col in names else pl.lit(False) for col, value in filters.items()
+    ]
+    if len(exprs) > 0:
+        df = df.filter(*exprs)
+    if columns is not None:
+        df = df.select([col for col in columns if col in names])
+    return df
+
+
+# Fragments written by one run share its timestamp as name
+def get_run() -> str:
+    return datetime.now().strftime("%Y-%m-%dT%H-%M-%S-%f")
+
+
+def get_partition_dir(dataset: Path, partition_by: str, value) -> Path:
+    name = hive_null if value is None else quote(str(value), safe="")
+    folder = Path(dataset) / f"{partition_by}={name}"
+    folder.mkdir(parents=True, exist_ok=True)
+    return folder
+
+
+# Write new data as one new fragment per partition value
+# Enums are written as Categoricals, scans of fragments written otherwise can not be combined
+def append_to_dataset(new_df: pl.LazyFrame, dataset: Path, partition_by: str):
+    new_df = new_df.lazy().with_columns(cs.by_dtype(pl.Enum).cast(pl.Categorical))
+    run = get_run()
+
+    values = new_df.select(pl.col(partition_by).unique()).collect()[partition_by]
+    for value in values:
+        folder = get_partition_dir(dataset, partition_by, value)
+        new_df.filter(pl.col(partition_by).eq_missing(value)).drop(partition_by).sink_parquet(
+            folder / f"{run}.pq"
+        )
+
+
+# Convert a single file dataset into a partitioned one, only required once
+def migrate_dataset(dataset: Path, partition_by: str):
+    if not os.path.isfile(dataset):
+        return
+
+    legacy = Path(f"{dataset}.legacy")
+    os.rename(dataset, legacy)
+    append_to_dataset(pl.scan_parquet(legacy), dataset, partition_by)
+    legacy.unlink()
+
+
+# Remove rows of files, only fragments containing these files are rewritten
+# Files are identified by the file column, or another column such as run_id
+def remove_files_from_dataset(dataset: Path, files: list, col: str = "file"):
+    for fragment in get_fragments(dataset):
+        df = pl.scan_parquet(fragment)
+        if df.filter(pl.col(col).is_in(files)).select(pl.len()).collect().item() == 0:
+            continue
+
+        df = df.filter(~pl.col(col).is_in(files))
+        # Empty parquet files break reading, drop the fragment instead
+        if df.select(pl.len()).collect().item() == 0:
+            fragment.unlink()
+            continue
+
+        # Reading and sinking into the same file fails, use temporary file
+        df.sink_parquet(f"{fragment}.2")
+        os.rename(f"{fragment}.2", fragment)
+
+
+def remove_dataset(dataset: Path):
+    if os.path.isdir(dataset):
+        shutil.rmtree(dataset)
+    else:
+        Path(dataset).unlink(missing_ok=True)
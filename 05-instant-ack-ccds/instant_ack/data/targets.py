@@ -0,0 +1,56 @@
+from pathlib import Path
+import hashlib
+import os
+
+import polars as pl
+
+from instant_ack import config
+
+# Index of qscanner target files, maps quic.scid to the requested domain (sni)
+# Each targets file is parsed once and cached as parquet, keyed by the hash of its content
+cache_dir = config.INTERIM_DATA_DIR / "targets"
+
+
+def get_file_hash(file: Path) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(file, "rb") as f:
+        while chunk := f.read(2**20):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# Read target file that includes quic.scid to join domains
+def read_targets(file: Path) -> pl.DataFrame:
+    schema = {
+        "scid": pl.String,
+    }
+    usecols = ["scid", "sni"]
+
+    df = pl.read_csv(file, schema_overrides=schema).select(usecols).drop_nulls()
+    # One domain per scid, the lookup requires unique keys
+    return df.unique("scid", keep="first", maintain_order=True).with_columns(
+        pl.col("sni").cast(pl.Categorical)
+    )
+
+
+# Load the scid -> sni table of a targets file, parsed only if not cached yet
+def load_targets(file: Path) -> pl.DataFrame:
+    cached = cache_dir / f"{get_file_hash(file)}.pq"
+    if cached.is_file():
+        return pl.read_parquet(cached)
+
+    df = read_targets(file)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    # Concurrent writers of the same file must not expose partial files
+    df.write_parquet(f"{cached}.{os.getpid()}")
+    os.replace(f"{cached}.{os.getpid()}", cached)
+    return df
+
+
+# Domain of a packet, looked up by quic.dcid (requests) or else quic.scid (responses)
+def lookup_sni(targets: pl.DataFrame) -> pl.Expr:
+    old, new = targets["scid"], targets["sni"].cast(pl.String)
+    return pl.coalesce(
+        pl.col(col).replace_strict(old, new, default=None, return_dtype=pl.String)
+        for col in ["quic.dcid", "quic.scid"]
+    ).alias("sni")
@@ -8,11 +8,18 @@ from instant_ack import config
 from instant_ack.data import preprocess_qscanner
 from instant_ack.data import convenience as cv
 from instant_ack.data import preprocess_qlog as pre_qlog
+from instant_ack.data import manifest
+from instant_ack.data import storage
+from instant_ack.data import jobs
+from instant_ack.data import runs
+from instant_ack.data import connections
+from instant_ack.data import cache
 import psutil
 import subprocess
-import sys
 import polars as pl
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
 
 app = typer.Typer()
 
@@ -20,10 +27,27 @@ app = typer.Typer()
 # Delete provided files
 def clean_files(files: list[Path]):
     for file in files:
-        file.unlink(missing_ok=True)
+        storage.remove_dataset(file)
+
+
+# Extract QUIC fields of pcaps into pcap.csv files next to them
+# Backends: tshark (tools/tshark-extract-quic-fields.sh run by jobs) or python (in-process)
+# procs=0 sizes the number of parallel processes by CPU count and available memory
+def extract_quic_fields(pcaps: list[Path], task_list: Path, procs: int, backend: str):
+    procs = jobs.get_procs(procs)
+    if backend == "python":
+        logger.info(f"Running in-process extraction with {procs} parallel processes")
+        preprocess_qscanner.extract_all_files(pcaps, procs)
+        return
+
+    logger.info("Generating list of tshark tasks")
+    preprocess_qscanner.generate_task_list(pcaps, task_list)
+
+    jobs.run_task_list(task_list, procs)
 
 
 # Process qscanner results, i.e. use tshark to extract from the collected pcaps
+# With stream, extracted fields are written to the output directly instead of pcap.csv files
 def process_qscanner(
     procs: int,
     refresh: bool,
@@ -31,22 +55,17 @@ def process_qscanner(
     in_dir: Path,
     out_file: Path,
     glob: str = "*/data/*",
+    backend: str = "tshark",
+    stream: bool = False,
 ):
     pcaps = cv.glob_sort_folder(in_dir, f"{glob}/capture.pcap.zst")
+    if stream:
+        procs = jobs.get_procs(procs)
+        logger.info(f"Streaming extracted fields with {procs} parallel processes")
+        preprocess_qscanner.stream_all_files(pcaps, out_file, procs, backend, refresh=refresh)
+        return
 
-    logger.info("Generating list of tshark tasks")
-    preprocess_qscanner.generate_task_list(pcaps, task_list)
-
-    logger.info(f"Running tshark extraction with {procs} parallel processes")
-    with subprocess.Popen(
-        f"parallel --bar -j {procs} -a {task_list}",
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        shell=True,
-    ) as p:
-        while p.poll() is None:
-            text = p.stderr.read1().decode("utf-8")
-            print(text, end="", flush=True, file=sys.stderr)
+    extract_quic_fields(pcaps, task_list, procs, backend)
 
     logger.info("Processing created csvs")
     csvs = cv.glob_sort_folder(in_dir, f"{glob}/pcap.csv")
@@ -70,7 +89,10 @@ def clean_cloudflare(
 ):
 
     csvs = cv.glob_sort_folder(in_dir, "*/data/*/pcap.csv")
-    clean_files([out_file, task_list] + csvs)
+    clean_files(
+        [out_file, manifest.get_manifest_file(out_file), task_list, jobs.get_job_log(task_list)]
+        + csvs
+    )
 
 
 # Process pcaps and qscanner header files for measurement of Cloudflare IACK deployment
@@ -81,6 +103,8 @@ def cloudflare(
     task_list: Path = cloudflare["task_list"],
     in_dir: Path = cloudflare["in_dir"],
     out_file: Path = cloudflare["out_file"],
+    backend: str = "tshark",
+    stream: bool = False,
 ):
 
     schema = {
@@ -118,7 +142,16 @@ def cloudflare(
         # Release memory
         header_out_file = []
 
-        process_qscanner(procs, refresh, task_list, location, out_file, glob="data/*")
+        process_qscanner(
+            procs,
+            refresh,
+            task_list,
+            location,
+            out_file,
+            glob="data/*",
+            backend=backend,
+            stream=stream,
+        )
 
 
 # toplist defaults
@@ -137,7 +170,10 @@ def clean_toplist(
 ):
 
     csvs = cv.glob_sort_folder(in_dir, "*/data/*/pcap.csv")
-    clean_files([out_file, task_list] + csvs)
+    clean_files(
+        [out_file, manifest.get_manifest_file(out_file), task_list, jobs.get_job_log(task_list)]
+        + csvs
+    )
 
 
 # Extract information from Qscanner run on toplist
@@ -148,8 +184,10 @@ def toplist(
     task_list: Path = toplist["task_list"],
     in_dir: Path = toplist["in_dir"],
     out_file: Path = toplist["out_file"],
+    backend: str = "tshark",
+    stream: bool = False,
 ):
-    process_qscanner(procs, refresh, task_list, in_dir, out_file)
+    process_qscanner(procs, refresh, task_list, in_dir, out_file, backend=backend, stream=stream)
 
 
 # QIR defaults
@@ -165,7 +203,64 @@ def clean_interop(
 ):
 
     files = cv.glob_sort_folder(folder, "qlog.*.pq.zst")
-    clean_files(files)
+    clean_files(
+        files
+        + [manifest.get_manifest_file(file) for file in files]
+        + [runs.get_runs_file(file) for file in files]
+        + [connections.get_connections_file(file) for file in files]
+    )
+
+
+# Remove cached results of get_measurement
+@app.command()
+def clean_cache():
+    cache.clear()
+
+
+# Manifest entries of qlog files contained in a folder
+def get_folder_manifest(folder: Path, processed: dict) -> dict:
+    files = cv.glob_sort_folder(folder, config.PAT_REPEATED_MEASUREMENT)
+    return {str(f): processed[str(f)] for f in files if str(f) in processed}
+
+
+# Process folders in a process pool, each worker writes one parquet fragment per folder
+# Fragments are named by the folder index, which keeps the output independent of the worker count
+def folders_to_fragments(
+    folders: list[Path], processed: dict, fragment_dir: Path, workers: int
+) -> list[Path]:
+    fragment_dir.mkdir(parents=True, exist_ok=True)
+    clean_files(cv.glob_sort_folder(fragment_dir, "*.pq"))
+
+    # Avoid oversubscription, every worker runs its own polars thread pool
+    os.environ.setdefault("POLARS_MAX_THREADS", str(max(1, os.cpu_count() // workers)))
+
+    # polars is not fork-safe, use spawned processes
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        futures = [
+            executor.submit(
+                pre_qlog.folder_to_fragment,
+                folder,
+                # Only pass the manifest entries of the folder to the worker
+                get_folder_manifest(folder, processed),
+                fragment_dir / f"{i:06d}.pq",
+            )
+            for i, folder in enumerate(folders)
+        ]
+        fragments = [future.result() for future in tqdm(as_completed(futures), total=len(futures))]
+
+    return sorted(fragment for fragment in fragments if fragment is not None)
+
+
+# Append read folders to the dataset of a client
+def flush_dfs(dfs: list[pl.DataFrame], dest: Path):
+    if len(dfs) == 0:
+        return
+
+    df = pl.concat(dfs, how="diagonal")
+    df = df.select(sorted(df.columns))
+    runs.sink_runs_and_events(df, dest)
 
 
 # Process data from modified QUIC interop runner
@@ -175,7 +270,13 @@ def interop(
     in_dir: Path = interop["in_dir"],
     out_dir: Path = interop["out_dir"],
     glob=config.PAT_INTEROP_RESULT_FOLDER,
+    workers: int = 1,
+    memory_budget: float = 0,
 ):
+    # Memory budget in GB for read data before flushing, default is a quarter of the available memory
+    budget = memory_budget * 1_000_000_000
+    if budget <= 0:
+        budget = psutil.virtual_memory().available / 4
 
     for client in [
         "aioquic",
@@ -196,30 +297,37 @@ def interop(
         folders = cv.glob_sort_folder(c_folder, glob)
 
         # Get files already read
-        current_files, current_df = pre_qlog.get_files_if_dest_exists(dest, refresh=refresh)
+        processed = pre_qlog.get_files_if_dest_exists(dest, refresh=refresh)
+
+        if workers > 1:
+            fragment_dir = out_dir / f"qlog.{c_folder.parts[-1]}.fragments"
+            fragments = folders_to_fragments(folders, processed, fragment_dir, workers)
+
+            if len(fragments) > 0:
+                df = pl.concat([pl.scan_parquet(f) for f in fragments], how="diagonal")
+                # Column order of the json reader differs between processes, fix it
+                df = df.select(sorted(df.collect_schema().names()))
+                runs.sink_runs_and_events(df, dest)
+
+            clean_files(fragments)
+            fragment_dir.rmdir()
+            continue
 
         dfs = []
+        batch_size = 0
         for folder in (pbar := tqdm(folders)):
             pbar.set_postfix({"new": len(dfs), "folder": (folder.parts[-1])}, refresh=True)
-            df = pre_qlog.folder_to_df(folder, current_files)
+            df = pre_qlog.folder_to_df(folder, processed)
             if df is not None:
-                dfs.append(
-                    df.with_columns(
-                        folder=pl.lit(str(folder)),
-                    )
-                )
+                dfs.append(df)
+                batch_size += df.estimated_size()
 
-            if psutil.virtual_memory()[1] / 1_000_000_000 < 40:
-                # No more memory break and try to merge
-                logger.warning(
-                    "Not enough spare memory, aborting reading data, but concatenating read data. Restart data aggregation to continue..."
-                )
-                break
+            # Write read data as fragments when exceeding the memory budget and continue
+            if batch_size > budget:
+                flush_dfs(dfs, dest)
+                dfs, batch_size = [], 0
 
-        if len(dfs) > 0:
-            df = pl.concat(dfs, how="diagonal")
-
-            cv.sink_parquet_and_merge_if_exists(current_df, df, dest)
+        flush_dfs(dfs, dest)
 
 
 public_interop = {
@@ -277,6 +385,7 @@ def interop_servers(
     refresh: bool = False,
     task_list: Path = public_interop["task_list_parallel"],
     out_file: Path = public_interop["out_file"],
+    backend: str = "tshark",
 ):
 
     logger.info("Generating download URLs")
@@ -290,41 +399,37 @@ def interop_servers(
                 print(url, file=file)
 
     logger.info("Downloading data")
-    with subprocess.Popen(
+    # wget reports progress on stderr, which is passed through
+    subprocess.run(
         f"wget -m --cut-dirs 1 -nH -P {in_dir} $(cat {task_file})",
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
         shell=True,
-    ) as p:
-        while p.poll() is None:
-            text = p.stderr.read1().decode("utf-8")
-            print(text, end="", flush=True, file=sys.stderr)
+    )
 
     # Client perspective
     pcaps = cv.glob_sort_folder(in_dir, "*/*/*/*/trace_node_left.pcap")
-    logger.info("Generating list of tshark tasks")
-    preprocess_qscanner.generate_task_list(pcaps, task_list)
-
-    logger.info(f"Running tshark extraction with {procs} parallel processes")
-    with subprocess.Popen(
-        f"parallel --bar -j {procs} -a {task_list}",
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        shell=True,
-    ) as p:
-        while p.poll() is None:
-            text = p.stderr.read1().decode("utf-8")
-            print(text, end="", flush=True, file=sys.stderr)
+    # Traces checked by the interop runner come with their packet table, not dissected again
+    dissected = {pcap for pcap in pcaps if preprocess_qscanner.is_valid_sidecar(pcap)}
+    extract_quic_fields(
+        [pcap for pcap in pcaps if pcap not in dissected], task_list, procs, backend
+    )
     dfs = []
 
-    for file in tqdm(cv.glob_sort_folder(in_dir, "*/*/*/*/pcap.csv")):
-        if os.stat(file).st_size != 0:
-            df = preprocess_qscanner.load_parsed(file).with_columns(
-                measurement_ts=pl.lit(str(file.parts[-5])),
-                server=pl.lit(str(file.parts[-4]).split("_", 1)[0]),
+    for pcap in tqdm(pcaps):
+        file = pcap.parent / "pcap.csv"
+        if pcap in dissected:
+            df = preprocess_qscanner.load_sidecar(preprocess_qscanner.get_sidecar(pcap))
+        elif file.is_file() and os.stat(file).st_size != 0:
+            df = preprocess_qscanner.load_parsed(file)
+        else:
+            continue
+        dfs.append(
+            df.with_columns(
+                measurement_ts=pl.lit(str(pcap.parts[-5])),
+                server=pl.lit(str(pcap.parts[-4]).split("_", 1)[0]),
             )
-            dfs.append(df)
-    logger.info("Processing created csvs")
+        )
+    logger.info("Processing created csvs and packet tables")
     pl.concat(dfs, how="diagonal").sink_parquet(out_file)
 
 
@@ -9,6 +9,7 @@ from matplotlib.offsetbox import AnchoredText
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 from instant_ack.data import validation as v
+from instant_ack.data import schema
 from datetime import datetime
 
 
@@ -64,7 +65,7 @@ def strip(
     if validate:
         v.validate(df, [y, hue], expected_repetitions=validate, ignore=validate_ignore)
 
-    df = df.select(x, y, hue)
+    df = schema.decode(df.select(x, y, hue))
 
     sns.stripplot(
         df.sort(hue, descending=True),
@@ -194,7 +195,7 @@ def ecdf(
     if ax is None:
         fig, ax = vh.fig_ax(figsize=figsize)
 
-    sns.ecdfplot(df.sort(hue), x=x, hue=hue, ax=ax, **kwargs)
+    sns.ecdfplot(schema.decode(df).sort(hue), x=x, hue=hue, ax=ax, **kwargs)
 
     ax.set(ylim=(-0.05, 1.05))
     if xlim:
@@ -251,7 +252,7 @@ def line(
     if ax is None:
         fig, ax = vh.fig_ax(figsize=figsize)
 
-    sns.lineplot(df, x=x, y=y, ax=ax, hue=hue, palette=palette, **kwargs)
+    sns.lineplot(schema.decode(df), x=x, y=y, ax=ax, hue=hue, palette=palette, **kwargs)
     if legend:
         ax.legend(
             title=None,
@@ -461,7 +462,7 @@ def scatter_improvement_factors(
     #        verticalalignment="center")
 
     # Real data
-    data = data.rename({"client": "Client"})
+    data = schema.decode(data).rename({"client": "Client"})
 
     sns.scatterplot(
         data,